@@ -1,8 +1,20 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 import sys
+import os
 import re
+import time
+import copy
 import numpy
 import csv
+import bisect
+import itertools
+import hashlib
+import shutil
+import cPickle
+import cStringIO
+import multiprocessing
+import multiprocessing.pool
+from collections import OrderedDict
 
 __version__ = '0.5.1'
 
@@ -13,11 +25,26 @@ class ParseLinesError(ValueError):
 class ParseTableError(ValueError):
     pass
 
+class ReadTablesError(Exception):
+    pass
+
 # Single and double quotes (for ease of reading later)
 _sq = "'"
 _dq = '"'
 
-# Null file-like object.  Needed because pyfits spews warnings to stdout
+# Regular expressions to recognize table formats from the start of a file
+_re_vots_header = re.compile(r'^#\s*(FIELD|PARAM|COOSYS|DESCRIPTION)::\s*$', re.MULTILINE)
+_re_rdb_type = re.compile(r'^\d*[NSMD][<>]?$')
+
+# numpy types of the VOTS FIELD datatypes (None => string)
+_vots_datatypes = {'boolean': numpy.bool_, 'unsignedByte': numpy.uint8, 'short': numpy.int16,
+                   'int': numpy.int32, 'long': numpy.int64, 'float': numpy.float32,
+                   'double': numpy.float64, 'string': None, 'char': None, 'unicodeChar': None}
+
+# Leading bytes of compressed files
+_compression_magic = (('gzip', '\x1f\x8b'), ('bz2', 'BZh'), ('xz', '\xfd7zXZ\x00'))
+
+# Null file-like object, used to discard debug output
 class _NullFile:
     def write(self, data): pass
     def writelines(self, lines): pass
@@ -28,6 +55,97 @@ class _ParseDialect(object):
     def __str__(self):
         return str((self.quotechar, self.skipinitialspace, self.delimiter, self.comment))
 
+class ReadStats(object):
+    """
+    Timing and size statistics for the stages of reading a table.  Pass
+    ``profile=True`` (or a callback function) to read_ascii_table,
+    read_fits_table or read_table and the statistics are available as the
+    ``read_stats`` attribute of the result.
+
+    ``stages`` is the list of (stage, seconds, info) in the order they ran,
+    where ``info`` is a dict of stage details (e.g. the dialect tried and the
+    result).  ``info`` holds overall values such as the number of rows and
+    bytes and the dialect used.  If ``callback`` is given it is called as
+    ``callback(stage, seconds, info)`` at the end of each stage.
+    """
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.stages = []
+        self.info = {}
+        self.callback = callback
+
+    def stage(self, name, **info):
+        """Return a context manager that times stage ``name``."""
+        return _Stage(self, name, info)
+
+    def set(self, **info):
+        """Set overall values in ``info``."""
+        self.info.update(info)
+
+    def seconds(self, name=None):
+        """Total time in seconds of all stages (or all stages called ``name``)."""
+        return sum(sec for stage, sec, info in self.stages if name in (None, stage))
+
+    def __str__(self):
+        lines = ['%-20s %10.6f s  %s' % (stage, sec, info) for stage, sec, info in self.stages]
+        lines.append('%-20s %10.6f s  %s' % ('total', self.seconds(), self.info))
+        return '\n'.join(lines)
+
+class _Stage(object):
+    def __init__(self, stats, name, info):
+        self.stats = stats
+        self.name = name
+        self.info = info
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self.info
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.time() - self.t0
+        self.stats.stages.append((self.name, seconds, self.info))
+        if self.stats.callback is not None:
+            self.stats.callback(self.name, seconds, self.info)
+
+# Stand-in for ReadStats when profiling is disabled, so that timing a stage
+# costs only a method call
+class _NullStats(object):
+    enabled = False
+    def stage(self, name, **info): return _null_stage
+    def set(self, **info): pass
+
+class _NullStage(object):
+    def __enter__(self): return {}
+    def __exit__(self, exc_type, exc_value, traceback): pass
+
+_null_stats = _NullStats()
+_null_stage = _NullStage()
+
+def _get_stats(profile):
+    """Return the ReadStats for the ``profile`` option (None, True or a callback)."""
+    if not profile:
+        return _null_stats
+    return ReadStats(profile if callable(profile) else None)
+
+class TableSchema(object):
+    """
+    Layout of an ASCII table: the csv ``dialect`` (None for a one column
+    table) and the record ``dtype`` of the columns.  The schema inferred by
+    read_ascii_table is available as the ``table_schema`` attribute of the
+    result and can be passed as ``schema`` to read other tables with the same
+    layout, skipping the dialect search and column type inference::
+
+      schema = read_ascii_table('obs1.dat').table_schema
+      tables = read_tables(['obs2.dat', 'obs3.dat'], schema=schema)
+    """
+    def __init__(self, dialect, dtype):
+        self.dialect = dialect
+        self.dtype = numpy.dtype(dtype)
+
+    def __repr__(self):
+        return 'TableSchema(dialect=%s, dtype=%r)' % (self.dialect, self.dtype)
+
 def _parse_ascii_lines(lines, dialect):
     """
     Attempt to parse the supplied table lines given the csv dialect values.
@@ -55,8 +173,10 @@ def _parse_ascii_lines(lines, dialect):
         if dialect.cleanspaces:
             parsed_line = [x.strip() for x in parsed_line]
 
-        warnings += len(filter(lambda x: x.startswith(otherquotechar) and x.endswith(otherquotechar),
-                               parsed_line))
+        # Only look at individual fields if the other quote char is present at all
+        if otherquotechar in ''.join(parsed_line):
+            warnings += len(filter(lambda x: x.startswith(otherquotechar) and x.endswith(otherquotechar),
+                                   parsed_line))
 
         # Bail if different rows had different numbers of columns
         n_col_dist.add(n_cols)
@@ -69,7 +189,87 @@ def _parse_ascii_lines(lines, dialect):
     dialect.n_cols = n_cols
     return warnings, parsed_lines
         
-def _make_record_array(array, headerrow, datastart, headertype, colnames):
+def _int_column(strcol, dtype=numpy.int_):
+    """
+    Convert the string array ``strcol`` to the 64-bit integer ``dtype``.
+    numpy only raises OverflowError for a value that is out of range if it is
+    the last value of the array, so values long enough to be out of range
+    are checked.
+    """
+    col = strcol.astype(dtype)
+    if strcol.dtype.itemsize >= 19:
+        for i in numpy.flatnonzero(numpy.char.str_len(strcol) >= 19):
+            if int(strcol[i]) != col[i]:
+                raise OverflowError('%s is out of range for %s' % (strcol[i], col.dtype))
+    return col
+
+def _convert_column(values):
+    """
+    Convert a sequence of string ``values`` to a numpy array, trying int then
+    float and falling back to a fixed-width string column.  This gives the same
+    dtypes as calling int() / float() on every value and then using
+    numpy.rec.fromrecords.
+    """
+    strcol = numpy.array(values)
+    try:
+        return _int_column(strcol)
+    except OverflowError:
+        # With integers beyond the int64 range numpy infers the type of the
+        # python ints as for numpy.rec.fromrecords: uint64, float64 (mixed
+        # with negative values) or object (beyond the uint64 range)
+        try:
+            return numpy.array([int(x) for x in strcol.tolist()])
+        except ValueError:
+            pass
+    except ValueError:
+        pass
+    try:
+        return strcol.astype(numpy.float_)
+    except (ValueError, OverflowError):
+        return strcol
+
+def _astype_column(strcol, coltype):
+    """
+    Convert the string array ``strcol`` to ``coltype``, raising ValueError
+    if a value does not fit (including strings that are too long, integers
+    that are out of range or negative for an unsigned type and finite
+    numbers that overflow a float type).
+    """
+    if coltype.kind == 'S' and strcol.dtype.itemsize > coltype.itemsize:
+        raise ValueError('string too long for %s' % coltype)
+    if coltype.kind in 'iu':
+        wide = _int_column(strcol, numpy.int64 if coltype.kind == 'i' else numpy.uint64)
+        if coltype.kind == 'u':
+            # numpy wraps negative values around to large unsigned ones
+            for i in numpy.flatnonzero(numpy.char.find(strcol, '-') >= 0):
+                if int(strcol[i]) < 0:
+                    raise ValueError('negative value %s for %s' % (strcol[i], coltype))
+        col = wide.astype(coltype)
+        if numpy.any(col != wide):
+            raise ValueError('value out of range for %s' % coltype)
+        return col
+    col = strcol.astype(coltype)
+    if coltype.kind == 'f':
+        for i in numpy.flatnonzero(~numpy.isfinite(col)):
+            if strcol[i].strip().lstrip('+-').lower() not in ('inf', 'infinity', 'nan'):
+                raise ValueError('value %s out of range for %s' % (strcol[i], coltype))
+    return col
+
+def _typed_column(name, values, coltype):
+    """
+    Convert the string ``values`` of column ``name`` to ``coltype``, raising
+    ParseTableError if any value does not fit.
+    """
+    try:
+        return _astype_column(numpy.array(values, dtype=str), coltype)
+    except (ValueError, OverflowError), e:
+        raise ParseTableError('Column %r does not fit dtype %s (%s)' % (name, coltype, e))
+
+def _get_header_rows(headerrow, datastart, headertype):
+    """
+    Return the normalized (headerrow, datastart) row numbers, where a
+    headerrow of 0 means column names are auto-generated.
+    """
     # Deprecated way of specifying header/data row info
     if headertype is not None:
         if headertype == 'names':
@@ -84,47 +284,284 @@ def _make_record_array(array, headerrow, datastart, headertype, colnames):
         else:
             raise ParseTableError, "headertype must be 'names', 'rdb', or 'none'"
 
+    if not headerrow:
+        headerrow = 0
+    if datastart is None:
+        datastart = headerrow+1
+    return headerrow, datastart
+
+def _row_slice(rows):
+    """Return ``rows`` (None, a slice or a (start, stop) pair) as a slice."""
+    if rows is None:
+        return slice(None)
+    if isinstance(rows, slice):
+        return rows
+    start, stop = rows
+    return slice(start, stop)
+
+def _column_indices(names, columns):
+    """Return the indices of ``columns`` within ``names`` (all if columns is None)."""
+    if columns is None:
+        return range(len(names))
+    names = list(names)
+    try:
+        return [names.index(name) for name in columns]
+    except ValueError:
+        raise ValueError('Columns %s not found in table' %
+                         [name for name in columns if name not in names])
+
+def _split_columns(array, headerrow, datastart, headertype, colnames,
+                   columns=None, rows=None, stats=_null_stats, dtype=None):
+    """
+    Split the parsed rows ``array`` of an ASCII table into columns of string
+    values.  Returns (names, indices, columns, nrows) where ``names`` are all
+    the column names, ``indices`` the indices of the selected columns,
+    ``columns`` the list of string values for every column (None if not
+    selected for fixed-width lines) and ``nrows`` the number of data rows.
+    The rows in ``array`` are released.
+    """
+    headerrow, datastart = _get_header_rows(headerrow, datastart, headertype)
     if headerrow:
         header = array[headerrow-1]
     else:
-        headerrow = 0
         header = ['col%d' % (i+1) for i in range(len(array[0]))]
 
-    if datastart is None:
-        datastart = headerrow+1
-    data = array[datastart-1:]
-
-    could_be_int = [True] * len(header)
-    could_be_float = [True] * len(header)
+    # The field names of an explicit dtype select the columns.  For a table
+    # without a header they are the column names unless they are the col1,
+    # col2, ... names.
+    if dtype is not None and dtype.names is not None:
+        if columns is not None and tuple(columns) != dtype.names:
+            raise ParseTableError('columns %s do not match dtype names %s'
+                                  % (list(columns), list(dtype.names)))
+        if not headerrow and not colnames and not set(dtype.names) <= set(header):
+            if len(dtype.names) != len(header):
+                raise ParseTableError('dtype has %d columns but table has %d'
+                                      % (len(dtype.names), len(header)))
+            colnames = dtype.names
+        columns = dtype.names
+    names = colnames or header
 
     ncols = len(header)
+    try:
+        indices = _column_indices(names, columns)
+    except ValueError, e:
+        if dtype is None:
+            raise
+        raise ParseTableError('%s (dtype names %s)' % (e, list(dtype.names)))
+    if isinstance(array, _FixedWidthLines):
+        with stats.stage('split', columns=ncols) as info:
+            columns, nrows = array.columns(datastart-1, _row_slice(rows), indices)
+            info['rows'] = nrows
+        return names, indices, columns, nrows
+
+    # Transpose the parsed rows into columns of strings, releasing the rows as
+    # soon as the transpose is done so no per-cell python objects remain.
+    data = array[datastart-1:][_row_slice(rows)]
     nrows = len(data)
-    
-    for c in xrange(ncols):
-        for r in xrange(nrows):
-            if could_be_float[c]:
-                try:
-                    x = float(data[r][c])
-                except ValueError:
-                    could_be_float[c] = False
-            if could_be_int[c]:
-                try:
-                    x = int(data[r][c])
-                except ValueError:
-                    could_be_int[c] = False
-            if not could_be_int[c] and not could_be_float[c]:
-                break
-    
-    for c in xrange(ncols):
-        for r in xrange(nrows):
-            if could_be_int[c]:
-                data[r][c] = int(data[r][c])
-            elif could_be_float[c]:
-                data[r][c] = float(data[r][c])
+    with stats.stage('split', rows=nrows, columns=ncols):
+        columns = zip(*data) or [()] * ncols
+        del data, array[:]
+    return names, indices, columns, nrows
+
+def _convert_table_column(name, values, dtype=None):
+    """
+    Convert the string ``values`` of column ``name``, inferring the type if
+    ``dtype`` is None and otherwise using ``dtype`` (or its ``name`` field).
+    """
+    if dtype is None:
+        return _convert_column(values)
+    coltype = dtype if dtype.names is None else dtype[name]
+    return _typed_column(name, values, coltype)
+
+def _column_option(option, name, default=None):
+    """
+    Return the value of a per-column ``option`` for column ``name``: the
+    entry for ``name`` (or else the None key) if ``option`` is a dict and
+    otherwise ``option`` itself.
+    """
+    if isinstance(option, dict):
+        return option.get(name, option.get(None, default))
+    return default if option is None else option
+
+def _convert_null_column(name, values, tokens, dtype=None):
+    """
+    Convert the string ``values`` of column ``name`` as for
+    _convert_table_column, treating the values in ``tokens`` as missing.
+    Returns (column, mask) where ``mask`` flags the missing values of a
+    numeric column and is None if the column has none or is not numeric.
+    """
+    values = numpy.array(values, dtype=str)
+    tokens = list(tokens)
+    if not tokens or not len(values):
+        return _convert_table_column(name, values, dtype), None
+    mask = numpy.in1d(values, tokens)
+    if not mask.any():
+        return _convert_table_column(name, values, dtype), None
+
+    # Convert with a placeholder for the missing values so that they do not
+    # prevent the column from being numeric
+    filled = values.copy()
+    filled[mask] = '0'
+    col = _convert_table_column(name, filled, dtype)
+    if col.dtype.kind not in 'iuf':
+        return _convert_table_column(name, values, dtype), None
+    return col, mask
+
+def _fill_nulls(names, arrays, masks, null_fill):
+    """
+    Replace the missing values flagged in the dict ``masks`` of the columns
+    ``arrays`` with ``names`` in place by their ``null_fill`` value (NaN by
+    default).  Integer columns with a non-integral fill value become float.
+    Returns the dict of fill values of the integer columns.
+    """
+    int_nulls = {}
+    for i, name in enumerate(names):
+        if name not in masks:
+            continue
+        fill = _column_option(null_fill, name, numpy.nan)
+        col = arrays[i]
+        if col.dtype.kind in 'iu':
+            if numpy.asarray(fill).dtype.kind in 'iu' and numpy.can_cast(
+                    numpy.min_scalar_type(fill), col.dtype):
+                int_nulls[name] = fill
+            else:
+                col = col.astype(numpy.float64)
+        col[masks[name]] = fill
+        arrays[i] = col
+    return int_nulls
+
+def _make_record_array(array, headerrow, datastart, headertype, colnames,
+                       columns=None, rows=None, stats=_null_stats, dtype=None,
+                       categorical=None, null_values=None, null_fill=None):
+    names, indices, columns, nrows = _split_columns(array, headerrow, datastart, headertype,
+                                                    colnames, columns, rows, stats, dtype)
+
+    # Convert column-wise and let numpy infer/convert each column in bulk.
+    # Columns that are not selected are never converted.
+    with stats.stage('convert', rows=nrows, columns=len(indices)):
+        arrays = []
+        masks = {}
+        for c in indices:
+            if null_values is None:
+                arrays.append(_convert_table_column(names[c], columns[c], dtype))
+            else:
+                col, mask = _convert_null_column(names[c], columns[c],
+                                                 _column_option(null_values, names[c], ()),
+                                                 dtype)
+                arrays.append(col)
+                if mask is not None:
+                    masks[names[c]] = mask
+            columns[c] = None
+
+    names = [names[c] for c in indices]
+    if null_values is None:
+        null_fill = None
+    if null_fill is not None:
+        int_nulls = _fill_nulls(names, arrays, masks, null_fill)
+    if categorical:
+        with stats.stage('categorical') as info:
+            categories = _encode_categories(names, arrays, categorical)
+            info['columns'] = len(categories)
+
+    with stats.stage('build'):
+        data = numpy.rec.fromarrays(arrays, names=names)
+        if null_values is not None and null_fill is None:
+            mask = numpy.zeros(len(data), dtype=dict(names=names, formats=[bool] * len(names)))
+            for name in masks:
+                mask[name] = masks[name]
+            data = numpy.ma.array(data, mask=mask)
+    if null_fill is not None:
+        data.nulls = int_nulls
+    if categorical:
+        data.categories = categories
+    return data
+
+def _encode_categories(names, arrays, categorical, max_ratio=0.5):
+    """
+    Dictionary-encode the columns ``arrays`` with ``names`` in place, replacing
+    each encoded column by its integer codes.  With ``categorical=True`` the
+    string columns are encoded if the codes and categories take at most
+    ``max_ratio`` of the memory of the strings, otherwise the columns in the
+    list ``categorical`` are encoded.  Returns the dict of column name to
+    the sorted array of distinct values (the categories).
+    """
+    if categorical is not True:
+        _column_indices(names, categorical)
+    categories = {}
+    for i, name in enumerate(names):
+        col = arrays[i]
+        if categorical is True:
+            if col.dtype.kind != 'S' or col.ndim != 1:
+                continue
+        elif name not in categorical:
+            continue
+        values, codes = numpy.unique(col, return_inverse=True)
+        codes = codes.astype(numpy.min_scalar_type(max(len(values) - 1, 0)))
+        if (categorical is True
+                and codes.nbytes + values.nbytes > max_ratio * col.nbytes):
+            continue
+        categories[name] = values
+        arrays[i] = codes
+    return categories
+
+def _decoded_dtype(dtype, categories):
+    """Return record ``dtype`` with the columns in ``categories`` as their values."""
+    if not categories:
+        return dtype
+    return numpy.dtype(dict(names=dtype.names,
+                            formats=[categories[name].dtype if name in categories
+                                     else dtype[name] for name in dtype.names]))
+
+def _compression(filename):
+    """Return the compression ('gzip', 'bz2' or 'xz') of ``filename`` or None."""
+    with open(filename, 'rb') as fh:
+        head = fh.read(6)
+    for compression, magic in _compression_magic:
+        if head.startswith(magic):
+            return compression
+    return None
+
+def _open_file(filename):
+    """
+    Open ``filename`` for reading.  Files compressed with gzip, bzip2 or xz are
+    recognized from their first bytes and decompressed as they are read.
+    """
+    compression = _compression(filename)
+    if compression == 'gzip':
+        import gzip
+        return gzip.GzipFile(filename, 'rb')
+    elif compression == 'bz2':
+        import bz2
+        return bz2.BZ2File(filename, 'r')
+    elif compression == 'xz':
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                raise IOError('Reading xz compressed file %s requires the lzma module'
+                              % filename)
+        return lzma.LZMAFile(filename, 'rb')
+    return open(filename, 'r')
 
-    return numpy.rec.fromrecords(data, names=(colnames or header))
+def _open_lines(indata):
+    """
+    Return an iterable of lines from ``indata``, which is either a file name
+    (possibly compressed) or an iterable (list or file) object.
+    """
+    try:
+        # Assume the indata parameter is a string file name and see how it goes
+        return _open_file(indata)
+    except TypeError:
+        # Should be something iterable
+        if not hasattr(indata, '__iter__'):
+            raise TypeError, 'Need to supply a readable file name or iterable (list or file) object'
+        return indata
 
-def read_ascii_table(indata, headerrow=1, datastart=None, **opt):
+def read_ascii_table(indata, headerrow=1, datastart=None, columns=None, rows=None,
+                     workers=None, profile=None, dtype=None, schema=None, lazy=False,
+                     categorical=None, null_values=None, null_fill=None, **opt):
     """
     Read the given ASCII data table (supplied as a list of strings or a file object).  Try
     each of the delimiters and quotechars in order and stop for the first case gives a
@@ -147,48 +584,447 @@ def read_ascii_table(indata, headerrow=1, datastart=None, **opt):
     :param datastart: Row number of data start (default=None => headerrow+1)
     :param headertype: Deprecated, use headerrow and datastart instead.
     :param colnames: Explicitly set column names from list
+    :param columns: List of column names to return (default=None => all columns)
+    :param rows: Data row range to return as a slice or (start, stop) (default=None => all rows)
+    :param sniff_lines: Number of sample lines used to sniff the dialect for large tables
+    :param fixed_width: Slice fields at fixed offsets if a large table has aligned columns
+    :param workers: Number of processes used to parse a table file (default=None => 1)
+    :param profile: Record stage timings in a ReadStats object (True or a callback function)
+    :param dtype: Column dtype(s) to convert to instead of inferring them
+    :param schema: TableSchema (e.g. ``table_schema`` of another table) giving dialect and dtype
+    :param lazy: Return a LazyTable that converts each column the first time it is accessed
+    :param categorical: Dictionary-encode repetitive string columns (True) or these columns (list)
+    :param null_values: List of values marking missing data, or dict of lists by column name
+    :param null_fill: Value (or dict of values by column name) replacing missing data
     :param loud: Print debug info
 
+    With ``dtype`` the column types are not inferred.  A record dtype gives the
+    type of each returned column by name (and so selects the columns), while a
+    plain dtype such as ``float`` applies to every column.  With ``schema`` the
+    dialect is not searched for either and the table must have the same number
+    of columns as the schema.  A value that does not fit its column type
+    raises ParseTableError.  The ``workers`` option is ignored for these reads.
+
+    With ``lazy=True`` the table is parsed and split into columns of strings
+    but no column is converted until it is accessed with ``data['col1']`` or
+    ``data.field('col1')``.  The ``colnames`` are available without any
+    conversion, while ``dtype`` converts the remaining columns (unless given
+    by ``dtype`` or ``schema``) and other indexing converts the whole table.
+    The ``table_schema`` attribute is only set when ``dtype`` or ``schema``
+    is given.
+
+    With ``categorical`` the selected columns are stored as integer codes
+    into a sorted array of their distinct values, and the ``categories``
+    attribute is the dict of these arrays keyed by column name.  With
+    ``categorical=True`` this is done for the string columns whose codes and
+    categories take at most half the memory of the strings.  Rows can then
+    be selected with ``data[name] == category_code(data, name, value)`` and
+    decode_categories gives back the table of values.  write_fits_table
+    writes the values of encoded columns.  Slices of the table do not keep
+    the ``categories`` attribute.
+
+    With ``null_values`` the listed values (e.g. ``['', '-', 'NA']``) are
+    recognized as missing in every column, or with a dict in the columns it
+    names, where the None key gives the default list.  Numeric columns with
+    missing values keep their numeric type and the table is returned as a
+    numpy masked array whose mask flags the missing values.  With
+    ``null_fill`` the missing values are replaced instead (NaN for columns
+    not given a fill value, making integer columns float) and the ``nulls``
+    attribute gives the fill value of each integer column, which
+    write_fits_table uses as its TNULL value.  String columns keep the
+    missing values as they are.  The ``workers`` option is ignored and
+    ``lazy`` is not supported for these reads.
+
     """
+    stats = _get_stats(profile)
+    if stats.enabled and isinstance(indata, basestring):
+        stats.set(bytes=os.path.getsize(indata))
+    if schema is not None and dtype is None:
+        dtype = schema.dtype
+    if dtype is not None:
+        dtype = numpy.dtype(dtype)
+    if categorical and lazy:
+        raise ValueError('categorical columns are not supported with lazy=True')
+    if null_values is not None and lazy:
+        raise ValueError('null_values is not supported with lazy=True')
 
-    try:
-        # Assume the indata parameter is a string file name and see how it goes
-        lines = open(indata, 'r')
-    except TypeError:
-        # Should be something iterable
-        if not hasattr(indata, '__iter__'):
-            raise TypeError, 'Need to supply a readable file name or iterable (list or file) object'
-        lines = indata
-    dialect, parsed_lines = _parse_ascii_table(lines, **opt)
-    data_recarray = _make_record_array(parsed_lines, headerrow, datastart,
-                                       opt.get('headertype'), opt.get('colnames'))
-    data_recarray.parse_table_dialect = dialect
-    data_recarray.colnames = data_recarray.dtype.names
+    data_recarray = None
+    if (workers > 1 and rows is None and dtype is None and not lazy
+            and null_values is None and isinstance(indata, basestring)):
+        with stats.stage('parallel_parse', workers=workers):
+            data_recarray = _read_ascii_table_parallel(indata, workers, headerrow, datastart,
+                                                       columns, **opt)
+        if data_recarray is not None and categorical:
+            names = data_recarray.dtype.names
+            arrays = [data_recarray[name] for name in names]
+            categories = _encode_categories(names, arrays, categorical)
+            dialect = data_recarray.parse_table_dialect
+            data_recarray = numpy.rec.fromarrays(arrays, names=names)
+            data_recarray.categories = categories
+            data_recarray.parse_table_dialect = dialect
+            data_recarray.colnames = names
+
+    if data_recarray is None:
+        with stats.stage('open'):
+            lines = _open_lines(indata)
+        if schema is not None:
+            dialect, parsed_lines = _parse_schema_lines(lines, schema, opt.get('comment', r' *#'),
+                                                        stats)
+        else:
+            dialect, parsed_lines = _parse_ascii_table(lines, stats=stats, **opt)
+        if lazy:
+            data_recarray = _make_lazy_table(parsed_lines, headerrow, datastart,
+                                             opt.get('headertype'), opt.get('colnames'),
+                                             columns, rows, stats, dtype)
+        else:
+            data_recarray = _make_record_array(parsed_lines, headerrow, datastart,
+                                               opt.get('headertype'), opt.get('colnames'),
+                                               columns, rows, stats, dtype, categorical,
+                                               null_values, null_fill)
+            data_recarray.colnames = data_recarray.dtype.names
+        data_recarray.parse_table_dialect = dialect
+    if not lazy or dtype is not None:
+        data_recarray.table_schema = TableSchema(
+            data_recarray.parse_table_dialect,
+            _decoded_dtype(data_recarray.dtype, getattr(data_recarray, 'categories', None)))
+
+    if stats.enabled:
+        stats.set(rows=len(data_recarray), dialect=str(data_recarray.parse_table_dialect))
+        data_recarray.read_stats = stats
     return data_recarray
 
-def _parse_ascii_table(lines,
-                       delimiters=['|', '&', ',', '\t' ,' '],
-                       comment=r' *#',
-                       quotechars=[_dq, _sq],
-                       cleanspaces=True,
-                       headertype='names',
-                       loud=None,
-                       colnames=None,
-                      ):
+def _make_lazy_table(array, headerrow, datastart, headertype, colnames,
+                     columns=None, rows=None, stats=_null_stats, dtype=None):
+    """
+    Return a LazyTable of the parsed rows ``array`` that converts each column
+    of string values (as for _make_record_array) the first time it is accessed.
+    """
+    names, indices, columns, nrows = _split_columns(array, headerrow, datastart, headertype,
+                                                    colnames, columns, rows, stats, dtype)
+    index = dict((names[c], c) for c in indices)
 
-    # Make sure the quotechars list is valid
-    if not set(quotechars) <= set([_dq, _sq]):
-        raise ParseTableError, "quotechars list can only contain a single or double quote"
+    def load_column(name):
+        c = index[name]
+        col = _convert_table_column(name, columns[c], dtype)
+        columns[c] = None
+        return col
 
-    dialect_for = {}
-    parsed_lines_for = {}
-    re_comment = re.compile(comment)
-    debug = (loud and sys.stderr) or _NullFile()
+    selected = [names[c] for c in indices]
+    if dtype is not None and dtype.names is None:
+        dtype = numpy.dtype(dict(names=selected, formats=[dtype] * len(selected)))
+    return LazyTable(selected, nrows, load_column, dtype)
 
-    # Make a copy in memory of in_lines with comments removed
-    data_lines = [x for x in lines if not re_comment.match(x)]
+def _parse_ascii_range(args):
+    """
+    Parse and convert the data lines in bytes [start, stop) of ``filename`` for
+    _read_ascii_table_parallel.  Returns the list of column arrays for the
+    selected column ``indices``, or None if the lines do not parse cleanly with
+    ``dialect``.  Columns in ``force_str`` are returned as strings.
+    """
+    filename, start, stop, dialect, re_comment, indices, force_str = args
+    with open(filename, 'r') as fh:
+        fh.seek(start)
+        lines = [x for x in cStringIO.StringIO(fh.read(stop - start))
+                 if not re_comment.match(x)]
+    if not lines:
+        return []
+    if dialect.skipinitialspace:
+        lines = [x.strip() for x in lines]
+    try:
+        warnings, parsed_lines = _parse_ascii_lines(lines, dialect)
+    except ParseLinesError:
+        return None
+    if warnings or dialect.n_cols != dialect.n_header_cols:
+        return None
+    del lines
+
+    columns = zip(*parsed_lines)
+    del parsed_lines
+    arrays = []
+    for c in indices:
+        if c in force_str:
+            arrays.append(numpy.array(columns[c]))
+        else:
+            arrays.append(_convert_column(columns[c]))
+        columns[c] = None
+    return arrays
+
+def _read_ascii_table_parallel(filename, workers, headerrow, datastart, columns,
+                               sniff_lines=1000, **opt):
+    """
+    Read the ASCII table ``filename`` using ``workers`` processes.  The dialect
+    and header are found once from the leading lines, then the data section is
+    split into byte ranges on line boundaries that are parsed and converted in
+    separate processes.  Column types are merged across ranges so that the
+    result is identical to the serial read_ascii_table.  Returns None if the
+    table is not suitable for a parallel read (the caller then reads it
+    serially).
+    """
+    # Byte ranges only make sense for an uncompressed file
+    if _compression(filename) is not None:
+        return None
+    re_comment = re.compile(opt.get('comment', r' *#'))
+    headerrow, datastart = _get_header_rows(headerrow, datastart, opt.get('headertype'))
+
+    # Sample the leading lines and find the byte offset where the data start
+    sample_lines = []
+    data_offset = None
+    with open(filename, 'r') as fh:
+        while len(sample_lines) < max(sniff_lines, datastart):
+            if len(sample_lines) == datastart - 1:
+                data_offset = fh.tell()
+            line = fh.readline()
+            if not line:
+                break
+            if not re_comment.match(line):
+                sample_lines.append(line)
+        fh.seek(0, 2)
+        filesize = fh.tell()
+    if data_offset is None or len(sample_lines) < datastart:
+        return None
+
+    dialect, parsed_lines = _parse_ascii_table(sample_lines, sniff_lines=sniff_lines,
+                                               **dict(opt, fixed_width=False))
+    if dialect is None or dialect.n_cols < 2:
+        return None
+    if headerrow:
+        header = parsed_lines[headerrow-1]
+    else:
+        header = ['col%d' % (i+1) for i in range(dialect.n_cols)]
+    names = opt.get('colnames') or header
+    dialect.n_header_cols = len(header)
+    indices = _column_indices(names, columns)
+    if not indices:
+        return None
+    del parsed_lines, sample_lines
+
+    # Split the data section into byte ranges that end on line boundaries
+    bounds = [data_offset]
+    with open(filename, 'r') as fh:
+        for i in range(1, workers):
+            fh.seek(max(data_offset + (filesize - data_offset) * i // workers, bounds[-1]))
+            fh.readline()
+            bounds.append(max(fh.tell(), bounds[-1]))
+    bounds.append(filesize)
+    ranges = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    def parse_ranges(ranges, force_str):
+        args = [(filename, start, stop, dialect, re_comment, indices, force_str)
+                for start, stop in ranges]
+        pool = multiprocessing.Pool(min(workers, len(args)))
+        try:
+            return pool.map(_parse_ascii_range, args, chunksize=1)
+        finally:
+            pool.terminate()
+
+    chunks = parse_ranges(ranges, set())
+    if any(chunk is None for chunk in chunks):
+        return None
+    chunks = [chunk for chunk in chunks if chunk]
+    if not chunks:
+        return None
+
+    # Column types must agree across chunks.  Numeric columns that are strings
+    # in any chunk are re-parsed as strings since the original text is needed.
+    force_str = set()
+    for i, c in enumerate(indices):
+        if len(set(chunk[i].dtype.kind for chunk in chunks)) > 1:
+            if any(chunk[i].dtype.kind == 'S' for chunk in chunks):
+                force_str.add(c)
+    if force_str:
+        redo = [j for j, chunk in enumerate(chunks)
+                if any(chunk[indices.index(c)].dtype.kind != 'S' for c in force_str)]
+        for j, chunk in zip(redo, parse_ranges([ranges[j] for j in redo], force_str)):
+            chunks[j] = chunk
+
+    # The dict form of the dtype keeps an empty column name (the list form
+    # renames it f0)
+    formats = []
+    for i, c in enumerate(indices):
+        kinds = set(chunk[i].dtype.kind for chunk in chunks)
+        if 'S' in kinds:
+            coltype = 'S%d' % max(chunk[i].dtype.itemsize for chunk in chunks)
+        elif 'f' in kinds:
+            coltype = numpy.float_
+        elif 'O' in kinds:
+            coltype = object
+        elif 'u' in kinds:
+            # numpy promotes int64 and uint64 values of a whole column to float
+            coltype = numpy.uint64 if kinds == set('u') else numpy.float_
+        else:
+            coltype = numpy.int_
+        formats.append(coltype)
+    dtype = numpy.dtype(dict(names=[names[c] for c in indices], formats=formats))
+
+    out = numpy.recarray(sum(len(chunk[0]) for chunk in chunks), dtype=dtype)
+    i0 = 0
+    for chunk in chunks:
+        i1 = i0 + len(chunk[0])
+        for i, c in enumerate(indices):
+            out[names[c]][i0:i1] = chunk[i]
+            chunk[i] = None
+        i0 = i1
+
+    del dialect.n_header_cols
+    out.parse_table_dialect = dialect
+    out.colnames = out.dtype.names
+    return out
+
+def _promote_dtype(dtype, values):
+    """
+    Return the narrowest of int, uint64, object (integers beyond uint64),
+    float and string (at least as wide as ``dtype``) that can hold both
+    ``dtype`` and the string ``values``.  As for _convert_column, int and
+    uint64 values together need float.
+    """
+    new_dtype = _convert_column(values).dtype
+    kinds = 'iuOfS'
+    if set([dtype.kind, new_dtype.kind]) == set('iu'):
+        new_dtype = numpy.dtype(numpy.float_)
+    elif kinds.index(new_dtype.kind) < kinds.index(dtype.kind):
+        new_dtype = dtype
+    if new_dtype.kind == 'S':
+        width = max(numpy.array(values).dtype.itemsize,
+                    dtype.itemsize if dtype.kind == 'S' else 0)
+        new_dtype = numpy.dtype('S%d' % width)
+    return new_dtype
+
+def _chunk_column(strcol, coltype):
+    """
+    Convert the string array ``strcol`` to ``coltype`` as for _astype_column,
+    where an object column (from integers beyond uint64) holds python ints.
+    """
+    if coltype.kind == 'O':
+        return numpy.array([int(x) for x in strcol.tolist()], dtype=object)
+    return _astype_column(strcol, coltype)
+
+def _convert_chunk(parsed_lines, dtype, widen=False, row0=0):
+    """
+    Convert ``parsed_lines`` (list of rows of strings) to a record array with
+    the given ``dtype``.  A value that does not fit its column type raises
+    ParseTableError unless ``widen`` is True, in which case the column type is
+    promoted (int => float => string, or a wider string).
+    """
+    columns = zip(*parsed_lines)
+    del parsed_lines[:]
+
+    names = dtype.names
+    arrays = []
+    for c, name in enumerate(names):
+        coltype = dtype[name]
+        values = columns[c]
+        strcol = numpy.array(values)
+        try:
+            arrays.append(_chunk_column(strcol, coltype))
+        except (ValueError, OverflowError), e:
+            if not widen:
+                raise ParseTableError('Column %r in rows %d-%d does not fit dtype %s (%s); '
+                                      'use widen=True to promote the column type'
+                                      % (name, row0 + 1, row0 + len(values), coltype, e))
+            arrays.append(_chunk_column(strcol, _promote_dtype(coltype, values)))
+        columns[c] = None
+
+    return numpy.rec.fromarrays(arrays, names=names)
+
+def read_ascii_table_chunks(indata, chunk_rows=100000, headerrow=1, datastart=None,
+                            widen=False, **opt):
+    """
+    Read the given ASCII data table in chunks of ``chunk_rows`` rows.  This is a
+    generator that yields numpy record arrays so that arbitrarily large tables can
+    be processed in constant memory.
+
+    The dialect, header and column dtypes are determined from the leading
+    ``sniff_lines`` lines of the table (see read_ascii_table) and are then fixed
+    for the rest of the table.  If a later value does not fit its column type
+    then ParseTableError is raised, unless ``widen`` is True in which case the
+    column is promoted (int => float => string, or a wider string) for that and
+    all subsequent chunks.
+
+    :param indata: File name or iterable file-like or list object
+    :param chunk_rows: Number of rows in each yielded record array
+    :param headerrow: Row number of header (default=1, None => column names auto-generated)
+    :param datastart: Row number of data start (default=None => headerrow+1)
+    :param widen: Promote column types that do not fit later chunks instead of raising
+    :param delimiters: List of single character delimiters (see read_ascii_table)
+    :param comment: RE for comment line if matched at beginning (can be a compiled re)
+    :param quotechars: List of possible quote characters
+    :param cleanspaces: Clean leading/trailing space chars from input lines and output data fields
+    :param headertype: Deprecated, use headerrow and datastart instead.
+    :param colnames: Explicitly set column names from list
+    :param sniff_lines: Number of leading lines used for the dialect, header and dtypes
+    :param loud: Print debug info
+    :rtype: generator of record arrays
+
+    The ``columns``, ``rows``, ``dtype``, ``null_values`` and other options of
+    read_ascii_table that select or convert columns are not supported.
+    """
+    lines = _open_lines(indata)
+    re_comment = re.compile(opt.get('comment', r' *#'))
+    headerrow, datastart = _get_header_rows(headerrow, datastart, opt.get('headertype'))
+    data_lines = (x for x in lines if not re_comment.match(x))
+
+    # Sniff the dialect, header and dtypes from a leading sample of lines
+    sample_lines = []
+    for line in data_lines:
+        sample_lines.append(line)
+        if len(sample_lines) >= max(opt.get('sniff_lines', 1000), datastart):
+            break
+    dialect, parsed_lines = _parse_ascii_table(list(sample_lines), **dict(opt, fixed_width=False))
+    if headerrow:
+        header = parsed_lines[headerrow-1]
+    else:
+        header = ['col%d' % (i+1) for i in range(len(parsed_lines[0]))]
+    sample = _make_record_array(parsed_lines[datastart-1:] or [[''] * len(header)],
+                                0, 1, None, opt.get('colnames') or header)
+    dtype = sample.dtype
+    del parsed_lines, sample
+
+    def parse_lines(chunk_lines):
+        if dialect is None:
+            return [[x.strip()] for x in chunk_lines]
+        if dialect.skipinitialspace:
+            chunk_lines = [x.strip() for x in chunk_lines]
+        try:
+            warnings, parsed = _parse_ascii_lines(chunk_lines, dialect)
+        except ParseLinesError, e:
+            raise ParseTableError('Rows %d-%d do not match dialect %s: %s'
+                                  % (row0 + 1, row0 + len(chunk_lines), dialect, e))
+        if dialect.n_cols != len(dtype):
+            raise ParseTableError('Rows %d-%d have %d columns, expected %d'
+                                  % (row0 + 1, row0 + len(chunk_lines),
+                                     dialect.n_cols, len(dtype)))
+        return parsed
+
+    row0 = 0
+    chunk_lines = sample_lines[datastart-1:]
+    del sample_lines
+    while True:
+        if len(chunk_lines) < chunk_rows:
+            chunk_lines.extend(itertools.islice(data_lines, chunk_rows - len(chunk_lines)))
+        if not chunk_lines:
+            break
+        chunk = _convert_chunk(parse_lines(chunk_lines[:chunk_rows]), dtype, widen, row0)
+        chunk_lines = chunk_lines[chunk_rows:]
+        dtype = chunk.dtype
+        row0 += len(chunk)
+        yield chunk
 
-    # Try to parse using each combination of quotechar and delimiter
+def _sample_lines(lines, n_sample):
+    """
+    Return a bounded sample of ``lines`` for dialect sniffing: the first half of
+    ``n_sample`` lines plus the remainder spread evenly through the rest of the
+    table.  Returns None if the table is not bigger than the sample.
+    """
+    n_lines = len(lines)
+    if not n_sample or n_lines <= n_sample:
+        return None
+    n_head = n_sample // 2
+    step = max((n_lines - n_head) // (n_sample - n_head), 1)
+    return lines[:n_head] + lines[n_head::step][:n_sample - n_head]
+
+def _candidate_dialects(quotechars, delimiters, comment, cleanspaces):
+    """Return the list of dialects to try, in order of preference."""
+    dialects = []
     for quotechar in quotechars:
         for delimiter in delimiters:
             # Create a dialect instance to manage the dialect settings
@@ -198,115 +1034,496 @@ def _parse_ascii_table(lines,
             dialect.delimiter = delimiter
             dialect.quotechar = quotechar
             dialect.cleanspaces = cleanspaces
+            dialects.append(dialect)
+    return dialects
 
-            # Optionally clean spaces from start and end of each input data line.
-            # For the 'space' delimiter this is always done.
-            if dialect.skipinitialspace:
-                lines = [x.strip() for x in data_lines]
-            else:
-                lines = data_lines
+def _search_dialects(data_lines, stripped_lines, dialects, debug, stats=_null_stats,
+                     stage='dialect'):
+    """
+    Try to parse the lines with each of ``dialects`` in order and stop at the
+    first that parses with no warnings.  Otherwise return the dialect with the
+    fewest warnings (the last one in case of a tie).  Returns (dialect, warnings,
+    parsed_lines), or (None, None, None) if no dialect split the lines.  Each
+    attempt is timed in ``stats`` as ``stage``.
+    """
+    best = (None, None, None)
 
-            print >>debug, 'TRYING dialect ',dialect,':',
+    for dialect in dialects:
+        # Optionally clean spaces from start and end of each input data line.
+        # For the 'space' delimiter this is always done.
+        lines = stripped_lines if dialect.skipinitialspace else data_lines
+
+        print >>debug, 'TRYING dialect ',dialect,':',
+        with stats.stage(stage, dialect=str(dialect), lines=len(lines)) as info:
             try:
                 (warnings, parsed_lines) = _parse_ascii_lines(lines, dialect)
+                info['warnings'] = warnings
             except ParseLinesError, e:
+                info['error'] = str(e)
                 print >>debug, e
                 continue
 
-            # If everything parsed with no warnings then we're done
-            if warnings == 0:
-                print >>debug, 'Good'
-                return dialect, parsed_lines
-            else:
-                # Otherwise keep the results keyed by the number of warnings
-                print >>debug, "Found warnings: ", warnings
-                dialect_for[warnings] = dialect
-                parsed_lines_for[warnings] = parsed_lines
-        # end delimiter
-    # end quotechar
-
-    # At this point none of the attempted dialects was perfect.  See what can be salvaged.
-    try:
-        # If some dialect parsed the data, but gave some warnings (e.g. values were left
-        # with leading and trailing quotes), then use the dialect with the fewest warnings
-        fewest_warnings = sorted(dialect_for.keys())[0]
-        return dialect_for[fewest_warnings], parsed_lines_for[fewest_warnings]
-    except IndexError:
-        # Found no dialect that split the data lines sensibly (or else it is just a
-        # one column table)
-        return None, [[x.strip()] for x in lines]
+        # If everything parsed with no warnings then we're done
+        if warnings == 0:
+            print >>debug, 'Good'
+            return dialect, warnings, parsed_lines
 
-def _parse_vots_header(lines, **opt):
-    """Parse VOTS header fields from 'lines', which should be an
-    iterable that returns lines of the VOTS table.  Returns an dict
-    of header fields where all but 'description' are in turn a numpy
-    recarray table."""
-    header = {}
-    keywords = ('DESCRIPTION::', 'COOSYS::', 'PARAM::', 'FIELD::')
-    key = 'none'
-    for line in lines:
-        line = line.strip()
-        if line in keywords:
-            key = line[:-2].lower()
-            continue
-        if key not in header:
-            header[key] = []
-        header[key].append(line)
+        # Otherwise keep only the result with the fewest warnings so far
+        print >>debug, "Found warnings: ", warnings
+        if best[1] is None or warnings <= best[1]:
+            best = (dialect, warnings, parsed_lines)
 
-    for key, val in header.items():
-        # Get rid of all blank lines at the end of the val list
-        while (len(val)>0 and re.search(r'$\s*^', val[-1])):
-            val.pop()
+    return best
 
-        # Flatten description key, otherwise parse lines as a table
-        if key == 'description':
-            header[key] = '\n'.join(header[key])
-        elif len(val) > 0:
-            header[key] = read_ascii_table(val, **opt)
+def _parse_ascii_table(lines,
+                       delimiters=['|', '&', ',', '\t' ,' '],
+                       comment=r' *#',
+                       quotechars=[_dq, _sq],
+                       cleanspaces=True,
+                       headertype='names',
+                       loud=None,
+                       colnames=None,
+                       sniff_lines=1000,
+                       fixed_width=True,
+                       stats=_null_stats,
+                      ):
 
-    return header
+    # Make sure the quotechars list is valid
+    if not set(quotechars) <= set([_dq, _sq]):
+        raise ParseTableError, "quotechars list can only contain a single or double quote"
 
-def read_vots_table(indata,
-                     delimiters=[' '],
-                     quotechars=["'"],
-                     cleanspaces=True,
-                     loud=False,
-                     ):
-    """
-    Read the given VOTS (VOTable Simple) data table (supplied as a list of
-    strings or a file object).  Try each of the delimiters and quotechars in
-    order and stop for the first case gives a sensible result.
+    re_comment = re.compile(comment)
+    debug = (loud and sys.stderr) or _NullFile()
 
-    :param indata: File name or iterable file-like or list object
+    # Make a copy in memory of in_lines with comments removed
+    with stats.stage('read_lines') as info:
+        data_lines = [x for x in lines if not re_comment.match(x)]
+        info['lines'] = len(data_lines)
+    dialects = _candidate_dialects(quotechars, delimiters, comment, cleanspaces)
+
+    # Sniff the dialect on a bounded sample of the lines and then parse the whole
+    # table once with the winner.  If the full parse disagrees with the sniff
+    # then fall through to the exhaustive search over all dialects.
+    sample_lines = _sample_lines(data_lines, sniff_lines)
+    stripped_lines = None
+    if sample_lines is not None:
+        print >>debug, 'SNIFFING %d of %d lines' % (len(sample_lines), len(data_lines))
+        dialect, warnings, parsed_lines = _search_dialects(
+            sample_lines, [x.strip() for x in sample_lines], dialects, debug,
+            stats, 'sniff')
+        del parsed_lines
+        if warnings == 0 and fixed_width and dialect.delimiter == ' ':
+            # Space separated columns may be aligned, in which case the fields
+            # are sliced out of the table at fixed offsets
+            with stats.stage('fixed_width') as info:
+                try:
+                    parsed_lines = _parse_fixed_width(data_lines, dialect)
+                except MemoryError:
+                    # The character block did not fit, so parse with csv
+                    parsed_lines = None
+                info['ok'] = parsed_lines is not None
+            if parsed_lines is not None:
+                print >>debug, 'Fixed width columns'
+                return dialect, parsed_lines
+        with stats.stage('strip_lines'):
+            stripped_lines = [x.strip() for x in data_lines]
+        if warnings == 0:
+            dialect, warnings, parsed_lines = _search_dialects(
+                data_lines, stripped_lines, [dialect], debug, stats, 'parse')
+            if warnings == 0:
+                return dialect, parsed_lines
+        print >>debug, 'Sniffed dialect rejected, trying all dialects'
+
+    # Lines with leading/trailing space stripped (shared by all dialects)
+    if stripped_lines is None:
+        with stats.stage('strip_lines'):
+            stripped_lines = [x.strip() for x in data_lines]
+    dialect, warnings, parsed_lines = _search_dialects(data_lines, stripped_lines,
+                                                       dialects, debug, stats)
+    if dialect is not None:
+        # If some dialect parsed the data, but gave some warnings (e.g. values were left
+        # with leading and trailing quotes), then this is the dialect with the fewest warnings
+        return dialect, parsed_lines
+
+    # Found no dialect that split the data lines sensibly (or else it is just a
+    # one column table)
+    return None, [[x] for x in stripped_lines]
+
+class _FixedWidthLines(object):
+    """
+    Parsed lines of a table with fixed-width columns, as returned by
+    _parse_fixed_width.  The leading ``head_rows`` (e.g. column names) are
+    lists of fields parsed with csv, and the remaining lines are the rows of
+    the 2-d uint8 array ``block`` with the fields at the (start, stop) column
+    ``spans``.  Rows can be indexed like the list of parsed lines, while
+    ``columns`` slices out whole columns.
+    """
+    def __init__(self, head_rows, block, spans):
+        self.head_rows = head_rows
+        self.block = block
+        self.spans = spans
+
+    def __len__(self):
+        return len(self.head_rows) + len(self.block)
+
+    def __getitem__(self, i):
+        if i < len(self.head_rows):
+            return self.head_rows[i]
+        row = self.block[i - len(self.head_rows)]
+        return [row[start:stop].tostring().strip() for start, stop in self.spans]
+
+    def columns(self, start, rows, indices):
+        """
+        Return (columns, nrows) for the lines from ``start`` and then the
+        ``rows`` slice.  Each column in ``indices`` is a numpy string array of
+        the stripped fields (as numpy.array would make from the list of
+        fields), others are None.
+        """
+        nhead = len(self.head_rows)
+        if start < nhead:
+            # Header rows within the data, so fall back to transposing rows
+            data = [self[i] for i in range(start, len(self))][rows]
+            columns = zip(*data) or [()] * len(self.spans)
+            return ([columns[c] if c in indices else None for c in range(len(self.spans))],
+                    len(data))
+
+        block = self.block[start - nhead:][rows]
+        columns = [None] * len(self.spans)
+        for c in indices:
+            columns[c] = self._column(block, *self.spans[c])
+        return columns, len(block)
+
+    @staticmethod
+    def _column(block, start, stop):
+        # Shift each field to the left of a (n, width) array with NUL
+        # padding, which numpy drops from the end of string values
+        field = block[:, start:stop]
+        nonblank = field != 32
+        lead = nonblank.argmax(axis=1)
+        length = nonblank.sum(axis=1)
+        width = max(length.max(), 1) if len(length) else 1
+        offsets = numpy.arange(width)
+        cols = numpy.minimum(lead[:, numpy.newaxis] + offsets, stop - start - 1)
+        out = field[numpy.arange(len(field))[:, numpy.newaxis], cols]
+        out[offsets >= length[:, numpy.newaxis]] = 0
+        return out.view('S%d' % width).ravel()
+
+def _parse_fixed_width(data_lines, dialect, max_head=10, max_pad=2):
+    """
+    Parse ``data_lines`` as a table of space separated fixed-width columns.
+    Column boundaries are the character positions that are blank in every
+    line after the first ``max_head`` lines.  Every line must then have
+    exactly one field (with no spaces) within each column, except for up to
+    ``max_head`` leading lines which are parsed with ``dialect`` and must
+    have the same number of fields.  Lines with quotes or other whitespace
+    than spaces are not handled, so that the fields are the same as for the
+    csv parse with ``dialect``.  Returns _FixedWidthLines or None if the
+    table is not fixed-width.
+
+    The lines are padded to the longest line in a block of characters, so
+    tables whose line lengths vary so much that the block would be more than
+    ``max_pad`` times the size of the lines are not handled either.
+    """
+    nlines = len(data_lines)
+    if nlines <= max_head:
+        return None
+    lengths = numpy.fromiter((len(x) for x in data_lines), dtype=numpy.int64, count=nlines)
+    if lengths.max() * nlines > max_pad * lengths.sum():
+        return None
+    lines = numpy.array(data_lines)
+    if lines.dtype.kind != 'S':
+        return None
+    block = lines.view(numpy.uint8).reshape(nlines, lines.dtype.itemsize)
+    del lines
+
+    # Tabs, vertical tabs, form feeds and quotes need the csv parser
+    for char in '\t\v\f' + _dq + _sq:
+        if (block == ord(char)).any():
+            return None
+    block[(block == 10) | (block == 13) | (block == 0)] = 32
+    nonblank = block != 32
+
+    # Column spans are the runs of positions that are not blank in every line
+    used = nonblank[max_head:].any(axis=0)
+    edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], used, [False]))))
+    spans = zip(edges[::2], edges[1::2])
+    if len(spans) < 2:
+        return None
+
+    # Each line needs exactly one field start in each span and nothing outside
+    starts = nonblank.copy()
+    starts[:, 1:] &= ~nonblank[:, :-1]
+    n_starts = numpy.add.reduceat(starts, edges[::2], axis=1, dtype=numpy.int32)
+    ok = numpy.all(n_starts == 1, axis=1) & ~numpy.any(nonblank[:, ~used], axis=1)
+    bad = numpy.flatnonzero(~ok)
+    nhead = bad[-1] + 1 if len(bad) else 0
+    if nhead > max_head:
+        return None
+
+    head_rows = []
+    if nhead:
+        head_lines = [x.strip() for x in data_lines[:nhead]]
+        try:
+            warnings, head_rows = _parse_ascii_lines(head_lines, dialect)
+        except ParseLinesError:
+            return None
+        if dialect.n_cols != len(spans):
+            return None
+    dialect.n_cols = len(spans)
+    return _FixedWidthLines(head_rows, block[nhead:], spans)
+
+def _parse_schema_lines(lines, schema, comment=r' *#', stats=_null_stats):
+    """
+    Parse ``lines`` with the dialect of ``schema`` instead of searching for
+    it.  Returns (dialect, parsed_lines) as for _parse_ascii_table, or raises
+    ParseTableError if the lines do not parse with the dialect or have a
+    different number of columns.
+    """
+    dialect = copy.copy(schema.dialect)
+    if dialect is not None:
+        comment = dialect.comment
+    re_comment = re.compile(comment)
+    with stats.stage('read_lines') as info:
+        data_lines = [x for x in lines if not re_comment.match(x)]
+        info['lines'] = len(data_lines)
+    if dialect is None:
+        return None, [[x.strip()] for x in data_lines]
+
+    if dialect.skipinitialspace:
+        data_lines = [x.strip() for x in data_lines]
+    with stats.stage('parse', dialect=str(dialect), lines=len(data_lines)) as info:
+        try:
+            warnings, parsed_lines = _parse_ascii_lines(data_lines, dialect)
+        except ParseLinesError, e:
+            raise ParseTableError('Table does not match schema dialect %s: %s' % (dialect, e))
+        info['warnings'] = warnings
+    if dialect.n_cols != schema.dialect.n_cols:
+        raise ParseTableError('Table has %d columns but schema has %d'
+                              % (dialect.n_cols, schema.dialect.n_cols))
+    return dialect, parsed_lines
+
+def _narrow_column(strcol, strip=True):
+    """
+    Return a copy of string array ``strcol`` narrowed to its longest value,
+    optionally stripping leading/trailing space first.
+    """
+    if strip:
+        strcol = numpy.char.strip(strcol)
+    width = numpy.char.str_len(strcol).max() if len(strcol) else 1
+    return strcol.astype('S%d' % max(width, 1))
+
+def _convert_rdb_column(rdbtype, strcol):
+    """
+    Convert the string array ``strcol`` of an RDB column according to its
+    declared type.  Numeric (N) columns are converted as by read_ascii_table
+    (int, then float, else left as strings if a value is empty or not a
+    number).  All other types are left as strings.
+    """
+    if not rdbtype.rstrip('<>').endswith('N'):
+        return strcol
+    # Convert a contiguous copy: numpy does not reliably detect empty or
+    # non-numeric values when casting a strided view of a 2-d string array
+    return _convert_column(numpy.ascontiguousarray(strcol))
+
+def read_rdb_table(indata, columns=None, rows=None, comment=r' *#', cleanspaces=True):
+    """
+    Read the given RDB data table (supplied as a list of strings or a file
+    object).  The first row has the tab-separated column names and the second
+    row the column types (e.g. ``N``, ``S`` or ``10N``), which are used directly
+    instead of searching for the dialect and inferring the column types.  The
+    body is split on tabs with no quoting.  Numeric columns are int if all
+    values are ints, otherwise float, and are left as strings if a value is
+    empty or not a number (as for read_ascii_table).  All other columns are
+    strings.
+
+    :param indata: File name or iterable file-like or list object
+    :param columns: List of column names to return (default=None => all columns)
+    :param rows: Data row range to return as a slice or (start, stop) (default=None => all rows)
+    :param comment: RE for comment line if matched at beginning (can be a compiled re)
+    :param cleanspaces: Clean leading/trailing space chars from data fields
+    :rtype: numpy record array
+    """
+    lines = _open_lines(indata)
+    re_comment = re.compile(comment)
+    data_lines = (x.rstrip('\r\n') for x in lines if not re_comment.match(x))
+
+    try:
+        names = [x.strip() for x in next(data_lines).split('\t')]
+        types = [x.strip() for x in next(data_lines).split('\t')]
+    except StopIteration:
+        raise ParseTableError('RDB table must have rows of column names and types')
+    if len(types) != len(names) or not all(_re_rdb_type.match(x) for x in types):
+        raise ParseTableError('Bad RDB column types row: %s' % '\t'.join(types))
+
+    parsed_lines = [x.split('\t') for x in data_lines if x.strip()]
+    ncols = len(names)
+    for i, parsed_line in enumerate(parsed_lines):
+        if len(parsed_line) != ncols:
+            raise ParseTableError('RDB data row %d has %d columns, expected %d'
+                                  % (i + 1, len(parsed_line), ncols))
+    parsed_lines = parsed_lines[_row_slice(rows)]
+
+    # Make one 2-d string array of the body in a single pass, then convert
+    # each selected column
+    indices = _column_indices(names, columns)
+    if parsed_lines:
+        table = numpy.array(parsed_lines, dtype=str)
+    else:
+        table = numpy.empty((0, ncols), dtype='S1')
+    del parsed_lines
+
+    arrays = []
+    for c in indices:
+        col = _convert_rdb_column(types[c], table[:, c])
+        # Numeric conversion already ignores surrounding space
+        if col.dtype.kind == 'S':
+            col = _narrow_column(col, strip=cleanspaces)
+        arrays.append(col)
+    del table
+
+    dialect = _ParseDialect()
+    dialect.comment = comment
+    dialect.skipinitialspace = False
+    dialect.delimiter = '\t'
+    dialect.quotechar = None
+    dialect.cleanspaces = cleanspaces
+    dialect.n_cols = ncols
+
+    data_recarray = numpy.rec.fromarrays(arrays, names=[names[c] for c in indices])
+    data_recarray.parse_table_dialect = dialect
+    data_recarray.colnames = data_recarray.dtype.names
+    return data_recarray
+
+def _parse_vots_header(lines, **opt):
+    """Parse VOTS header fields from 'lines', which should be an
+    iterable that returns lines of the VOTS table.  Returns an dict
+    of header fields where all but 'description' are in turn a numpy
+    recarray table."""
+    header = {}
+    keywords = ('DESCRIPTION::', 'COOSYS::', 'PARAM::', 'FIELD::')
+    key = 'none'
+    for line in lines:
+        line = line.strip()
+        if line in keywords:
+            key = line[:-2].lower()
+            continue
+        if key not in header:
+            header[key] = []
+        header[key].append(line)
+
+    for key, val in header.items():
+        # Get rid of all blank lines at the end of the val list
+        while (len(val)>0 and re.search(r'$\s*^', val[-1])):
+            val.pop()
+
+        # Flatten description key, otherwise parse lines as a table
+        if key == 'description':
+            header[key] = '\n'.join(header[key])
+        elif len(val) > 0:
+            header[key] = read_ascii_table(val, **opt)
+
+    return header
+
+def _convert_vots_column(name, datatype, values):
+    """
+    Convert the string ``values`` of VOTS column ``name`` to the numpy type of
+    its FIELD ``datatype``.  The type of a column with an unknown (or None)
+    datatype is inferred as for read_ascii_table.
+    """
+    if datatype not in _vots_datatypes:
+        return _convert_column(values)
+    coltype = _vots_datatypes[datatype]
+    strcol = numpy.array(values, dtype=str)
+    if coltype is None:
+        return strcol
+    if coltype is numpy.bool_:
+        lower = numpy.char.lower(strcol)
+        true = numpy.in1d(lower, ('t', 'true', '1'))
+        if not numpy.all(true | numpy.in1d(lower, ('f', 'false', '0'))):
+            raise ParseTableError('VOTS column %r is declared boolean but has other values'
+                                  % name)
+        return true
+    return _typed_column(name, strcol, numpy.dtype(coltype))
+
+def _vots_chunks(data_lines, dialect, names, datatypes, chunk_rows=None):
+    """
+    Parse the VOTS ``data_lines`` with the fixed ``dialect`` and yield record
+    arrays of up to ``chunk_rows`` rows (default=None => all rows) with the
+    column types of the FIELD ``datatypes``.
+    """
+    row0 = 0
+    while True:
+        chunk_lines = list(itertools.islice(data_lines, chunk_rows))
+        if not chunk_lines:
+            break
+        if len(names) == 1:
+            parsed_lines = [[x] for x in chunk_lines]
+        else:
+            try:
+                warnings, parsed_lines = _parse_ascii_lines(chunk_lines, dialect)
+            except ParseLinesError, e:
+                raise ParseTableError('VOTS rows %d-%d do not match dialect %s: %s'
+                                      % (row0 + 1, row0 + len(chunk_lines), dialect, e))
+            if dialect.n_cols != len(names):
+                raise ParseTableError('VOTS rows %d-%d have %d columns but there are %d FIELDs'
+                                      % (row0 + 1, row0 + len(chunk_lines),
+                                         dialect.n_cols, len(names)))
+        del chunk_lines
+
+        columns = zip(*parsed_lines)
+        del parsed_lines
+        arrays = []
+        for c, name in enumerate(names):
+            arrays.append(_convert_vots_column(name, datatypes[c], columns[c]))
+            columns[c] = None
+        data = numpy.rec.fromarrays(arrays, names=names)
+        data.parse_table_dialect = dialect
+        data.colnames = data.dtype.names
+        row0 += len(data)
+        yield data
+
+def read_vots_table_chunks(indata, chunk_rows=100000,
+                           delimiters=['\t', ' '],
+                           quotechars=["'"],
+                           cleanspaces=True,
+                           loud=False,
+                           datatypes=True,
+                           ):
+    """
+    Read the given VOTS (VOTable Simple) data table (supplied as a list of
+    strings or a file object) in chunks of ``chunk_rows`` rows.  The header
+    is read first and the data body is then streamed through a parser with a
+    fixed dialect: the first of ``delimiters`` found in the first data line
+    and the first of ``quotechars``.  The column types are those declared in
+    the FIELD header unless ``datatypes`` is False, in which case they are
+    inferred from the values of each chunk.  String columns are as wide as
+    the longest value in each chunk.
+
+    :param indata: File name or iterable file-like or list object
+    :param chunk_rows: Number of rows in each yielded record array
     :param delimiters: List of single character delimiters (no RE because csv can't do this)
     :param quotechars: List of possible quote characters
     :param cleanspaces: Clean leading/trailing space chars from input lines and output data fields
     :param loud: Print debug info
+    :param datatypes: Use the FIELD datatypes as the column types
 
-    :rtype: (header, data)
-
-    header: dict containing VOTS header elements
-    data: numpy record array object of the data table.
+    :rtype: (header, generator of record arrays)
     """
-    try:
-        # Assume the indata parameter is a string file name and see how it goes
-        lines = open(indata, 'r')
-    except TypeError:
-        # Should be something iterable
-        if not hasattr(indata, '__iter__'):
-            raise TypeError, 'Need to supply a readable file name or iterable (list or file) object'
-        lines = indata
+    lines = iter(_open_lines(indata))
 
+    # Header lines start with '#' and comments with '##'.  The data body
+    # starts at the first other non-blank line.
     headerlines = []
-    datalines = []
+    first_line = None
     for line in lines:
         line = line.strip()
         if line.startswith('##'):
             continue
         if line.startswith('#'):
             headerlines.append(line[1:])
-        else:
-            datalines.append(line)
+        elif line:
+            first_line = line
+            break
 
     header = _parse_vots_header(headerlines,
                                 delimiters=delimiters,
@@ -314,98 +1531,809 @@ def read_vots_table(indata,
                                 cleanspaces=cleanspaces,
                                 loud=loud,
                                 )
-    data = read_ascii_table(datalines,
-                             headertype='none',
-                             delimiters=delimiters,
-                             quotechars=quotechars,
-                             cleanspaces=cleanspaces,
-                             loud=loud,
-                             colnames=header['field'].field('name').tolist(),
-                             )
+    names = header['field'].field('name').tolist()
+    if datatypes:
+        field_types = header['field'].field('datatype').tolist()
+    else:
+        field_types = [None] * len(names)
+
+    delimiter = delimiters[0]
+    for x in delimiters:
+        if first_line is not None and x in first_line:
+            delimiter = x
+            break
+    dialect = _candidate_dialects(quotechars[:1], [delimiter], '#', cleanspaces)[0]
+
+    data_lines = (x for x in itertools.chain([first_line] if first_line else [],
+                                             (x.strip() for x in lines))
+                  if x and not x.startswith('#'))
+    return header, _vots_chunks(data_lines, dialect, names, field_types, chunk_rows)
+
+def read_vots_table(indata,
+                     delimiters=['\t', ' '],
+                     quotechars=["'"],
+                     cleanspaces=True,
+                     loud=False,
+                     datatypes=True,
+                     ):
+    """
+    Read the given VOTS (VOTable Simple) data table (supplied as a list of
+    strings or a file object).  The header is read once and the column types
+    are taken from the FIELD declarations (e.g. ``int`` => int32, ``double``
+    => float64, ``string`` => string), unless ``datatypes`` is False in which
+    case they are inferred from the values as for read_ascii_table.  The data
+    body is parsed in a single pass with a fixed dialect (see
+    read_vots_table_chunks).
+
+    :param indata: File name or iterable file-like or list object
+    :param delimiters: List of single character delimiters (no RE because csv can't do this)
+    :param quotechars: List of possible quote characters
+    :param cleanspaces: Clean leading/trailing space chars from input lines and output data fields
+    :param loud: Print debug info
+    :param datatypes: Use the FIELD datatypes as the column types
+
+    :rtype: (header, data)
+
+    header: dict containing VOTS header elements
+    data: numpy record array object of the data table.
+    """
+    header, chunks = read_vots_table_chunks(indata, None, delimiters, quotechars,
+                                            cleanspaces, loud, datatypes)
+    for data in chunks:
+        return header, data
+
+    # No data rows
+    names = header['field'].field('name').tolist()
+    field_types = header['field'].field('datatype').tolist() if datatypes else [None] * len(names)
+    data = numpy.rec.fromarrays([_convert_vots_column(name, datatype, ())
+                                 for name, datatype in zip(names, field_types)], names=names)
+    data.colnames = data.dtype.names
     return header, data
 
 
-def read_fits_table(infile, hdunum=1, pyfits=False):
+class LazyTable(object):
+    """
+    Table whose columns are loaded on first access and then cached.  Columns can
+    be accessed as for a record array with ``data['col1']`` or
+    ``data.field('col1')``, while any other indexing (e.g. ``data[2]``) first
+    materializes the whole table as a numpy record array.
+
+    The ``dtype`` is built from the loaded columns (loading any that are not
+    yet loaded) unless it is supplied.
+
+    :param names: column names
+    :param nrows: number of rows
+    :param load_column: function that takes a column name and returns the column array
+    :param dtype: record dtype of the columns if known in advance
+    """
+    def __init__(self, names, nrows, load_column, dtype=None):
+        self.colnames = tuple(names)
+        self._nrows = nrows
+        self._load_column = load_column
+        self._columns = {}
+        self._array = None
+        self._dtype = dtype
+
+    def field(self, name):
+        if isinstance(name, int):
+            name = self.colnames[name]
+        if name not in self._columns:
+            if name not in self.colnames:
+                raise ValueError('no field of name %s' % name)
+            self._columns[name] = self._load_column(name)
+        return self._columns[name]
+
+    def __getitem__(self, item):
+        if isinstance(item, basestring):
+            return self.field(item)
+        return self.as_array()[item]
+
+    def __len__(self):
+        return self._nrows
+
+    def __iter__(self):
+        return iter(self.as_array())
+
+    @property
+    def dtype(self):
+        if self._dtype is None:
+            # Use the dict form since a list of fields renames '' to 'f0'
+            cols = [self.field(name) for name in self.colnames]
+            self._dtype = numpy.dtype(dict(names=self.colnames,
+                                           formats=[(col.dtype, col.shape[1:]) for col in cols]))
+        return self._dtype
+
+    def as_array(self):
+        """Return all columns as a numpy record array."""
+        if self._array is None:
+            self._array = numpy.recarray(self._nrows, dtype=self.dtype)
+            for name in self.colnames:
+                self._array[name][:] = self.field(name)
+        return self._array
+
+def _native_dtype(col):
+    """Return the dtype of ``col`` in the native byte order of the processor."""
+    if col.dtype.isnative:
+        return col.dtype
+    return col.dtype.newbyteorder('=')
+
+def _fields_view(array, names):
+    """Return a view of record ``array`` with only the fields ``names`` (no copy)."""
+    fields = array.dtype.fields
+    dtype = numpy.dtype(dict(names=list(names),
+                             formats=[fields[name][0] for name in names],
+                             offsets=[fields[name][1] for name in names],
+                             itemsize=array.dtype.itemsize))
+    return array.view(dtype).view(numpy.recarray)
+
+def _key_index(index_file, infile, hdunum, key, keycol, step=1024):
+    """
+    Return the sparse index of sorted column ``keycol`` (the values at every
+    ``step`` rows) from ``index_file``, first (re)building the file if it is
+    missing or was made for a different version of the table.
+    """
+    stat = os.stat(infile)
+    ident = repr((os.path.abspath(infile), stat.st_size, stat.st_mtime, hdunum, key,
+                  len(keycol), step))
+    try:
+        index = numpy.load(index_file)
+        if str(index['ident']) == ident:
+            return index['keys'], step
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    keys = numpy.array(keycol[::step])
+    tmp = '%s.tmp-%d' % (index_file, os.getpid())
+    with open(tmp, 'wb') as fh:
+        numpy.savez(fh, ident=numpy.array(ident), keys=keys)
+    os.rename(tmp, index_file)
+    return keys, step
+
+def _key_rows(keycol, key_range, index=None):
+    """
+    Return the slice of rows of the sorted column ``keycol`` with values in
+    ``key_range`` = (start, stop), i.e. start <= value < stop, where None
+    means no limit.  Each bound is found by a binary search that reads only
+    a few values of ``keycol``, narrowed first with the sparse ``index`` =
+    (keys, step) if given.
+    """
+    nrows = len(keycol)
+
+    def bound(value, default):
+        if value is None:
+            return default
+        lo, hi = 0, nrows
+        if index is not None:
+            keys, step = index
+            i = bisect.bisect_left(keys, value)
+            lo, hi = max(i - 1, 0) * step, min(i * step, nrows)
+        return bisect.bisect_left(keycol, value, lo, hi)
+
+    start, stop = key_range
+    row0 = bound(start, 0)
+    return slice(row0, max(bound(stop, nrows), row0))
+
+def read_fits_table(infile, hdunum=1, pyfits=False, native='copy', columns=None,
+                    rows=None, profile=None, key=None, key_range=None, key_index=None):
     """Use pyfits to read the first HDU of the FITS table file 'infile'.  Returns a
     record array object which can be accessed either by row or column, e.g. data[2]
     or data.field('col1').
 
+    Allowed values of the ``native`` parameter are:
+
+    ========  ==============================================================
+    copy      copy all columns into a new record array with native byte order
+    lazy      memory-map the file and return a LazyTable that copies each
+              column to native byte order the first time it is accessed
+    raw       memory-map the file and return a record array view of the
+              stored (big-endian) data without copying.  Only for binary
+              tables, and logical or scaled columns hold the stored values.
+    ========  ==============================================================
+
     :param hdunum: HDU number for desired table (default=1)
     :param pyfits: Return as a pyfits.NP_pyfits.FITS_rec instead of numpy.rec.recarray.
+    :param native: How to convert to native byte order: 'copy', 'lazy' or 'raw'
+    :param columns: List of column names to read (default=None => all columns)
+    :param rows: Row range to read as a slice or (start, stop) (default=None => all rows)
+    :param profile: Record stage timings in a ReadStats object (True or a callback function)
+    :param key: Name of a column sorted in ascending order (e.g. 'TIME') to select rows by value
+    :param key_range: Read rows with start <= key < stop for (start, stop), None => no limit
+    :param key_index: File name of a sparse index of ``key`` to (re)use for key_range searches
     :rtype: Table object
+
+    With ``key`` and ``key_range`` the row bounds are found by a binary search
+    over the memory-mapped key column and only those rows are read, as for
+    ``rows``.  The optional ``key_index`` file holds every 1024th key value
+    and is rebuilt if the table file changes, so that repeated searches of
+    the same file touch only a few pages of the key column.
+    """
+    if native not in ('copy', 'lazy', 'raw'):
+        raise ValueError("native must be 'copy', 'lazy' or 'raw'")
+    if (key is None) != (key_range is None):
+        raise ValueError('key and key_range must be given together')
+    if key is not None and rows is not None:
+        raise ValueError('rows cannot be given with key_range')
+    stats = _get_stats(profile)
+    select = columns is not None or rows is not None or key is not None
+    with stats.stage('open', hdunum=hdunum):
+        hdu = _open_fits(infile, memmap=(native != 'copy' or select))[hdunum]
+
+    if key is not None:
+        with stats.stage('key_search', key=key) as info:
+            _column_indices(hdu.data.dtype.names, [key])
+            keycol = hdu.data.field(key)
+            index = None
+            if key_index is not None:
+                index = _key_index(key_index, infile, hdunum, key, keycol)
+            rows = _key_rows(keycol, key_range, index)
+            info['rows'] = rows.stop - rows.start
+
+    out = _read_fits_hdu(hdu, pyfits, native, columns, rows, stats)
+    if stats.enabled:
+        if isinstance(infile, basestring):
+            stats.set(bytes=os.path.getsize(infile))
+        stats.set(rows=len(out))
+        out.read_stats = stats
+    return out
+
+def _open_fits(infile, memmap=False):
+    """Open the FITS file ``infile`` (possibly compressed) as a pyfits HDUList."""
+    import pyfits
+    if isinstance(infile, basestring) and _compression(infile) is not None:
+        # Let pyfits read the decompressed stream, which only reads as far as
+        # the requested HDU and never writes the decompressed file to disk
+        return pyfits.open(_open_file(infile))
+    return pyfits.open(infile, memmap=memmap)
+
+def _read_fits_hdu(hdu, pyfits=False, native='copy', columns=None, rows=None,
+                   stats=_null_stats):
+    """
+    Return the selected ``columns`` and ``rows`` of table ``hdu`` as for
+    read_fits_table.
     """
     # import pyfits as pf so the pyfits keyword is not clobbered
     import pyfits as pf
-    hdu = pf.open(infile)[hdunum]
+
+    # Only the selected columns and rows of the (memory-mapped) data are touched
+    data = hdu.data[_row_slice(rows)] if rows is not None else hdu.data
+    allnames = hdu.data.dtype.names
+    # pyfits cannot convert the fields of zero rows of an ASCII table, so the
+    # columns of an empty selection are taken from the first row instead
+    fields = data if len(data) else hdu.data[:1]
+    colnames = [allnames[i] for i in _column_indices(allnames, columns)]
+
     if pyfits:
-        out = hdu.data
+        if columns is not None:
+            raise ValueError('columns cannot be selected with pyfits=True')
+        out = data
+    elif native == 'raw':
+        if not isinstance(hdu, pf.BinTableHDU):
+            raise ValueError("native='raw' requires a binary table HDU")
+        out = data.view(numpy.recarray)
+        if columns is not None:
+            out = _fields_view(out, colnames)
+    elif native == 'lazy':
+        def load_column(colname):
+            col = fields.field(colname)[:len(data)]
+            return col.astype(_native_dtype(col))
+        out = LazyTable(colnames, len(data), load_column)
     else:
         # Remake array to ensure native datatypes (i.e. match the endianness of
         # the processor).  Some numpy routines (e.g. searchsorted) don't notice
         # the dtype endianness specification and can fail.
         dtypes = []
-        colnames = hdu.data.dtype.names
         for colname in colnames:
-            col = hdu.data.field(colname)
-            if col.dtype.isnative:
-                dtype = (colname, col.dtype)
-            else:
-                dtype = (colname, col.dtype.type) 
-            if len(col.shape) > 1:
-                dtype = dtype + (tuple(col.shape[1:]),)
-            dtypes.append(dtype)
+            col = fields.field(colname)
+            dtypes.append((colname, _native_dtype(col), col.shape[1:]))
 
         # Now define a new recarray and copy the original data
         # Note: could use numpy.empty to generate a structured array.
-        out = numpy.recarray(len(hdu.data), dtype=dtypes)
-        for colname in colnames:
-            out[colname][:] = hdu.data.field(colname)
+        with stats.stage('copy', columns=len(colnames)):
+            out = numpy.recarray(len(data), dtype=dtypes)
+            for colname in colnames:
+                out[colname][:] = fields.field(colname)[:len(data)]
 
     return out
+
+class FitsTables(OrderedDict):
+    """
+    Tables read by read_fits_tables, keyed by HDU number in file order.  A
+    table can also be looked up by its EXTNAME (case insensitive) and the
+    ``headers`` attribute is an OrderedDict of the table headers keyed by HDU
+    number.
+    """
+    def __init__(self, *args, **kwargs):
+        OrderedDict.__init__(self, *args, **kwargs)
+        self.headers = OrderedDict()
+        self.extnames = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            key = self.extnames[key.upper()]
+        return OrderedDict.__getitem__(self, key)
+
+def read_fits_headers(infile):
+    """
+    Return the headers of all HDUs of the FITS file ``infile`` as an
+    OrderedDict keyed by HDU number.  The file is opened once and no table
+    data are read.
+
+    :param infile: Name of a (possibly compressed) FITS file or a file object
+    :rtype: OrderedDict of pyfits headers
+    """
+    return OrderedDict((i, hdu.header) for i, hdu in enumerate(_open_fits(infile, memmap=True)))
+
+def read_fits_tables(infile, hdus=None, native='copy', columns=None, rows=None, profile=None):
+    """
+    Read several table HDUs of the FITS file ``infile``, opening and parsing
+    the file only once.  Returns a FitsTables mapping of HDU number to table
+    (see read_fits_table) which also accepts the EXTNAME of an HDU as the key.
+    The header of each table is in the ``headers`` attribute.
+
+    :param infile: Name of a (possibly compressed) FITS file or a file object
+    :param hdus: List of HDU numbers or EXTNAMEs to read (default=None => all table HDUs)
+    :param native: How to convert to native byte order: 'copy', 'lazy' or 'raw'
+    :param columns: List of column names to read from each HDU (default=None => all columns)
+    :param rows: Row range to read from each HDU as a slice or (start, stop)
+    :param profile: Record stage timings in a ReadStats object (True or a callback function)
+    :rtype: FitsTables
+    """
+    import pyfits as pf
+    if native not in ('copy', 'lazy', 'raw'):
+        raise ValueError("native must be 'copy', 'lazy' or 'raw'")
+    stats = _get_stats(profile)
+    select = columns is not None or rows is not None
+    with stats.stage('open'):
+        hdulist = _open_fits(infile, memmap=(native != 'copy' or select))
+        extnames = dict((str(hdu.header.get('EXTNAME', '')).strip().upper(), i)
+                        for i, hdu in reversed(list(enumerate(hdulist))))
+
+    if hdus is None:
+        hdunums = [i for i, hdu in enumerate(hdulist)
+                   if isinstance(hdu, (pf.BinTableHDU, pf.TableHDU))]
+    else:
+        hdunums = []
+        for hdu in hdus:
+            if isinstance(hdu, basestring):
+                if hdu.upper() not in extnames:
+                    raise ValueError('No HDU with EXTNAME %s in %s' % (hdu, infile))
+                hdu = extnames[hdu.upper()]
+            if not 0 <= hdu < len(hdulist):
+                raise ValueError('No HDU %d in %s' % (hdu, infile))
+            hdunums.append(hdu)
+
+    tables = FitsTables()
+    for hdunum in hdunums:
+        hdu = hdulist[hdunum]
+        tables.headers[hdunum] = hdu.header
+        extname = str(hdu.header.get('EXTNAME', '')).strip().upper()
+        if extname and extname not in tables.extnames:
+            tables.extnames[extname] = hdunum
+        tables[hdunum] = _read_fits_hdu(hdu, False, native, columns, rows, stats)
+
+    if stats.enabled:
+        if isinstance(infile, basestring):
+            stats.set(bytes=os.path.getsize(infile))
+        stats.set(rows=sum(len(table) for table in tables.values()))
+        tables.read_stats = stats
+    return tables
     
-def read_table(file_or_data, **opt):
+def _guess_format(filename, nbytes=65536):
+    """
+    Guess the format of table file ``filename`` from its first ``nbytes``
+    bytes (after decompression).  Returns 'fits', 'vots', 'rdb' or 'ascii'.
+    """
+    fh = _open_file(filename)
+    try:
+        head = fh.read(nbytes)
+    finally:
+        fh.close()
+    return _guess_head_format(head)
+
+def _peek_format(fh, nbytes=65536):
+    """
+    Guess the format of the table in file object ``fh`` from its first
+    ``nbytes`` bytes, then seek back to where it was.  A file object that
+    cannot seek is first read into memory.  Returns (format, file object).
+    """
+    try:
+        pos = fh.tell()
+    except (AttributeError, IOError):
+        pos = None
+    head = fh.read(nbytes)
+    try:
+        fh.seek(pos)
+    except (AttributeError, IOError, TypeError):
+        fh = cStringIO.StringIO(head + fh.read())
+    return _guess_head_format(head), fh
+
+def _guess_head_format(head):
+    """
+    Guess the table format from ``head``, the first bytes of a table.
+    Returns 'fits', 'vots', 'rdb' or 'ascii'.
+    """
+    if head.startswith('SIMPLE  ='):
+        return 'fits'
+
+    # VOTS: leading comment block with a FIELD:: (etc) header keyword
+    lines = head.splitlines()
+    comments = list(itertools.takewhile(lambda x: x.startswith('#'), lines))
+    if _re_vots_header.search('\n'.join(comments)):
+        return 'vots'
+
+    # RDB: tab-separated column names followed by a row of column types
+    lines = [x for x in lines[len(comments):] if not x.lstrip().startswith('#')]
+    if len(lines) >= 2 and '\t' in lines[0]:
+        names = lines[0].split('\t')
+        types = lines[1].split('\t')
+        if len(names) == len(types) and all(_re_rdb_type.match(x.strip()) for x in types):
+            return 'rdb'
+
+    return 'ascii'
+
+def read_table(file_or_data, format=None, **opt):
     """
     All-purpose function to guess the format of a data table and read via the
-    format-specific parsers.  First tries FITS then ASCII.
+    format-specific parsers.  The format of a file is recognized from its first
+    bytes: FITS (``SIMPLE  =`` card), VOTS (``# FIELD::`` etc header), RDB
+    (row of column types after the column names) or otherwise ASCII.  RDB
+    tables are read as ASCII (use ``headertype='rdb'`` to skip the types row).
+    For a VOTS table the header is available as the ``vots_header`` attribute.
+    Files compressed with gzip, bzip2 or xz are decompressed as they are read.
+    With ``lazy=True`` an ASCII or FITS table is returned as a LazyTable that
+    converts each column the first time it is accessed.
 
-    :param file_or_data: Name of a file or some iterable object with the data
+    :param file_or_data: Name of a file, a file object or some iterable object with the data
+    :param format: Table format 'fits', 'vots', 'rdb' or 'ascii' (default=None => guess)
     :param opt: Other options specific to the format (see read_ascii_table and read_fits_table)
     :rtype: Table object
     """
-    _sys_stdout = sys.stdout
+    if format is None:
+        if isinstance(file_or_data, basestring):
+            format = _guess_format(file_or_data)
+        elif hasattr(file_or_data, 'read'):
+            format, file_or_data = _peek_format(file_or_data)
+        else:
+            format = 'ascii'
+
+    if format == 'fits':
+        if opt.pop('lazy', False):
+            opt['native'] = 'lazy'
+        return read_fits_table(file_or_data, **opt)
+    elif format == 'vots':
+        header, data = read_vots_table(file_or_data, **opt)
+        data.vots_header = header
+        return data
+    elif format in ('rdb', 'ascii'):
+        # The RDB column types row is only skipped with headertype='rdb'
+        return read_ascii_table(file_or_data, **opt)
+    else:
+        raise ValueError("format must be 'fits', 'vots', 'rdb' or 'ascii'")
+
+def _read_table_worker(args):
+    """
+    Read one table for read_tables, returning (data, attributes, error
+    message).  The attributes of the table (e.g. ``parse_table_dialect``)
+    are returned separately since pickling a record array drops them.
+    """
+    path, opt = args
     try:
-        sys.stdout = _NullFile()
-        data = read_fits_table(file_or_data, **opt)
-        sys.stdout = _sys_stdout
-    except (TypeError,IndexError,IOError):
-        sys.stdout = _sys_stdout
-        data = read_ascii_table(file_or_data, **opt)
-    except:
-        sys.stdout = _sys_stdout
-        raise
+        data = read_table(path, **opt)
+    except Exception, err:
+        return None, None, '%s: %s' % (err.__class__.__name__, err)
+    attrs = dict((key, val) for key, val in getattr(data, '__dict__', {}).items()
+                 if not key.startswith('_'))
+    return data, attrs, None
 
-    return data
+def _merge_dtypes(dtypes):
+    """
+    Return a dtype that can hold each of the record ``dtypes``, promoting
+    columns as needed (e.g. int => float or a wider string).
+    """
+    names = dtypes[0].names
+    formats = []
+    for name in names:
+        base = dtypes[0][name].base
+        shape = dtypes[0][name].shape
+        for dtype in dtypes[1:]:
+            if dtype.names != names or dtype[name].shape != shape:
+                raise ValueError('Tables have incompatible columns: %s and %s'
+                                 % (dtypes[0], dtype))
+            base = numpy.promote_types(base, dtype[name].base)
+        formats.append((base, shape))
+    # The dict form keeps an empty column name (the list form renames it f0)
+    return numpy.dtype(dict(names=names, formats=formats))
 
-def write_fits_table(outfile, recarray, header={}, clobber=True,
-                     units={}, nulls={}, bscales={}, bzeros={}, disps={}):
-    """Write ``recarray`` to a FITS binary table file.
+def concatenate_tables(tables):
+    """
+    Concatenate the record arrays ``tables`` into one record array, promoting
+    column types where needed (e.g. int => float or a wider string).  The output
+    is allocated once and filled column by column.  If any table is a masked
+    array (see the ``null_values`` option of read_ascii_table) then the output
+    is a masked array with the masks of the tables.  Each table has its own
+    categories, so tables read with the ``categorical`` option are decoded
+    (see decode_categories) and the output has the column values.
 
-    NOTES:
-      - Set the binary table extension name with ``header['extname']``
-      - Vector column elements should work.  Column elements with 2 or more
-        dimensions have not been tested and may have row-ordering issues.
+    :param tables: list of record arrays with the same column names
+    :rtype: numpy record array
+    """
+    tables = [decode_categories(table) if getattr(table, 'categories', None) else table
+              for table in tables]
+    dtype = _merge_dtypes([table.dtype for table in tables])
+    out = numpy.recarray(sum(len(table) for table in tables), dtype=dtype)
+    masked = any(isinstance(table, numpy.ma.MaskedArray) for table in tables)
+    if masked:
+        mask = numpy.zeros(len(out), dtype=dict(
+            names=dtype.names, formats=[(bool, dtype[name].shape) for name in dtype.names]))
+    i0 = 0
+    for table in tables:
+        i1 = i0 + len(table)
+        for name in dtype.names:
+            out[name][i0:i1] = table[name]
+            if masked:
+                mask[name][i0:i1] = numpy.ma.getmaskarray(table[name])
+        i0 = i1
+    if masked:
+        out = numpy.ma.array(out, mask=mask)
+    return out
 
-    :param outfile: output file name
-    :param recarray: input data (numpy record array)
-    :param header: dict of header keyword values
-    :param clobber: overwrite existing file (default True)
-    :param units: dict specifying column unit values
-    :param nulls: dict specifying column null values
-    :param bscales: dict specifying column bscale values
-    :param bzeros: dict specifying column bzero values
-    :param disps: dict specifying column disp values
-    :rtype: None
+def category_code(data, name, value):
     """
+    Return the code of ``value`` in dictionary-encoded column ``name`` of
+    ``data`` (see the ``categorical`` option of read_ascii_table), or -1 if it
+    is not one of the values so that no rows match.  Rows are selected with::
+
+      data[data['statname'] == category_code(data, 'statname', 'cash')]
+
+    :param data: table read with the categorical option
+    :param name: column name
+    :param value: column value
+    :rtype: int
+    """
+    values = data.categories[name]
+    i = numpy.searchsorted(values, value)
+    if i < len(values) and values[i] == value:
+        return int(i)
+    return -1
+
+def decode_categories(data, rows=None):
+    """
+    Return a record array of ``data`` (or the ``rows`` slice of it) with the
+    codes of dictionary-encoded columns (see the ``categorical`` option of
+    read_ascii_table) replaced by their values.  The mask of a masked array
+    is kept.
+
+    :param data: table read with the categorical option
+    :param rows: Row range to decode as a slice or (start, stop) (default=None => all rows)
+    :rtype: numpy record array
+    """
+    categories = getattr(data, 'categories', None) or {}
+    data = data[_row_slice(rows)]
+    out = numpy.recarray(len(data), dtype=_decoded_dtype(data.dtype, categories))
+    for name in data.dtype.names:
+        if name in categories:
+            out[name] = categories[name][data[name]]
+        else:
+            out[name] = data[name]
+    if isinstance(data, numpy.ma.MaskedArray):
+        out = numpy.ma.array(out, mask=numpy.ma.getmaskarray(data))
+    return out
+
+def read_tables(paths, workers=None, pool='process', concatenate=False, **opt):
+    """
+    Read the tables in ``paths`` with read_table in a pool of ``workers``
+    processes (or threads with ``pool='thread'``, which suits FITS files where
+    the reading is mostly I/O).  Returns the list of tables in input order or,
+    with ``concatenate=True``, a single record array (see concatenate_tables).
+
+    If any file fails to read then ReadTablesError is raised, naming the file.
+    Lazy tables (``lazy=True`` or ``native='lazy'``) can only be read with
+    ``pool='thread'`` or a single worker.
+
+    :param paths: list of file names
+    :param workers: number of workers (default=None => number of CPUs, 1 => no pool)
+    :param pool: 'process' or 'thread'
+    :param concatenate: return the concatenation of all tables
+    :param opt: Other options for read_table
+    :rtype: list of Table objects or record array
+    """
+    if pool not in ('process', 'thread'):
+        raise ValueError("pool must be 'process' or 'thread'")
+    paths = list(paths)
+    args = [(path, opt) for path in paths]
+    workers = min(workers or multiprocessing.cpu_count(), len(paths))
+    if (workers > 1 and pool == 'process'
+            and (opt.get('lazy') or opt.get('native') == 'lazy')):
+        raise ValueError("lazy tables cannot be returned from processes, use pool='thread'")
+
+    if workers <= 1:
+        results = [_read_table_worker(arg) for arg in args]
+    else:
+        if pool == 'process':
+            worker_pool = multiprocessing.Pool(workers)
+        else:
+            worker_pool = multiprocessing.pool.ThreadPool(workers)
+        try:
+            results = worker_pool.map(_read_table_worker, args, chunksize=1)
+        finally:
+            worker_pool.terminate()
+
+    tables = []
+    for path, (data, attrs, error) in zip(paths, results):
+        if error is not None:
+            raise ReadTablesError('Failed to read %s: %s' % (path, error))
+        for key, val in attrs.items():
+            setattr(data, key, val)
+        tables.append(data)
+    del results
+
+    if concatenate:
+        return concatenate_tables(tables)
+    return tables
+
+class TableCache(object):
+    """
+    Cache of parsed tables keyed on the absolute path, size and modification
+    time of the file together with the reader and its options.  Tables are held
+    in an in-process LRU cache limited to ``max_memory`` bytes and, if
+    ``cache_dir`` is given, saved there as a memory-mappable ``.npy`` file plus
+    metadata (including ``parse_table_dialect``).  The cache directory is kept
+    under ``max_disk`` bytes by removing the least recently used entries.
+
+    Example::
+
+      cache = TableCache('/tmp/table_cache', max_memory=500e6)
+      data = cache.read_table('t/short.rdb', headertype='rdb')
+      print cache.stats
+
+    Arrays returned from the cache are shared between calls and should not be
+    modified in place.  Only file names are cached, other inputs (and pyfits or
+    LazyTable results) are read directly.
+
+    :param cache_dir: Directory for persistent cache entries (default=None => memory only)
+    :param max_memory: Byte budget of the in-process cache
+    :param max_disk: Byte budget of the cache directory
+    """
+    def __init__(self, cache_dir=None, max_memory=1e9, max_disk=10e9):
+        self.cache_dir = cache_dir
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.stats = dict(memory_hits=0, disk_hits=0, misses=0, uncached=0)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def read_table(self, file_or_data, **opt):
+        """Cached version of read_table."""
+        return self.read(read_table, file_or_data, **opt)
+
+    def read_ascii_table(self, indata, **opt):
+        """Cached version of read_ascii_table."""
+        return self.read(read_ascii_table, indata, **opt)
+
+    def read_fits_table(self, infile, **opt):
+        """Cached version of read_fits_table."""
+        return self.read(read_fits_table, infile, **opt)
+
+    def read(self, reader, filename, **opt):
+        """
+        Return ``reader(filename, **opt)`` from the cache if possible, otherwise
+        call the reader and store the result.
+        """
+        key = self._key(reader, filename, opt)
+        if key is None:
+            self.stats['uncached'] += 1
+            return reader(filename, **opt)
+
+        if key in self._memory:
+            self.stats['memory_hits'] += 1
+            data = self._memory.pop(key)
+            self._memory[key] = data
+            return data
+
+        data = self._load(key)
+        if data is not None:
+            self.stats['disk_hits'] += 1
+        else:
+            self.stats['misses'] += 1
+            data = reader(filename, **opt)
+            if (not isinstance(data, numpy.ndarray) or data.dtype.hasobject
+                    or isinstance(data, numpy.ma.MaskedArray)):
+                return data
+            self._save(key, data)
+
+        self._remember(key, data)
+        return data
+
+    def clear(self):
+        """Remove all cache entries from memory and from the cache directory."""
+        self._memory.clear()
+        self._memory_bytes = 0
+        for key in self._disk_keys():
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _key(self, reader, filename, opt):
+        if not isinstance(filename, basestring):
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        if opt.get('pyfits') or opt.get('native', 'copy') != 'copy':
+            return None
+        ident = repr((os.path.abspath(filename), stat.st_size, stat.st_mtime,
+                      reader.__name__, sorted(opt.items())))
+        return hashlib.sha1(ident).hexdigest()
+
+    def _remember(self, key, data):
+        nbytes = data.nbytes
+        if nbytes > self.max_memory:
+            return
+        self._memory[key] = data
+        self._memory_bytes += nbytes
+        while self._memory_bytes > self.max_memory:
+            old_key, old_data = self._memory.popitem(last=False)
+            self._memory_bytes -= old_data.nbytes
+
+    def _disk_keys(self):
+        if self.cache_dir is None:
+            return []
+        return [x for x in os.listdir(self.cache_dir) if not x.startswith('.')]
+
+    def _load(self, key):
+        if self.cache_dir is None:
+            return None
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry, 'meta.pkl'), 'rb') as fh:
+                meta = cPickle.load(fh)
+            data = numpy.load(os.path.join(entry, 'data.npy'), mmap_mode='c')
+        except (IOError, OSError, ValueError, EOFError, cPickle.UnpicklingError):
+            return None
+        os.utime(entry, None)
+        data = data.view(numpy.recarray)
+        for attr, val in meta.items():
+            setattr(data, attr, val)
+        return data
+
+    def _save(self, key, data):
+        if self.cache_dir is None:
+            return
+        entry = os.path.join(self.cache_dir, key)
+        tmp = os.path.join(self.cache_dir, '.tmp-%s-%d' % (key, os.getpid()))
+        if not os.path.isdir(tmp):
+            os.makedirs(tmp)
+        meta = dict((attr, getattr(data, attr))
+                    for attr in ('parse_table_dialect', 'colnames', 'table_schema',
+                                 'categories', 'nulls', 'vots_header')
+                    if hasattr(data, attr))
+        numpy.save(os.path.join(tmp, 'data.npy'), data)
+        with open(os.path.join(tmp, 'meta.pkl'), 'wb') as fh:
+            cPickle.dump(meta, fh, protocol=2)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for key in self._disk_keys():
+            entry = os.path.join(self.cache_dir, key)
+            size = sum(os.path.getsize(os.path.join(entry, x)) for x in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+            total += size
+        for mtime, size, entry in sorted(entries):
+            if total <= self.max_disk:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+def _fits_columns(recarray, units={}, nulls={}, bscales={}, bzeros={}, disps={}):
+    """Return the list of pyfits.Column definitions for writing ``recarray``."""
     import pyfits
     np2fits = dict(b1 = 'L',  bool='L', u1 = 'B', i1 = 'I', i2 = 'I', i4 = 'J',
                    i8 = 'J', f4 = 'E', f8 = 'D', c8 = 'C', c16 = 'M')
@@ -421,10 +2349,11 @@ def write_fits_table(outfile, recarray, header={}, clobber=True,
         np_size = str(datacol.dtype.itemsize)
         np_fmt = np_kind + np_size
         try:
-            size = datacol[0].size
+            size = int(numpy.prod(datacol.shape[1:]))
             fits_fmt = str(size) + np2fits[np_fmt]
             if size > 1:
-                dims[colname] = "(%s)" % ",".join(str(x) for x in datacol[0].shape)
+                # FITS TDIM lists the fastest varying axis first
+                dims[colname] = "(%s)" % ",".join(str(x) for x in reversed(datacol.shape[1:]))
         except KeyError :
             if np_kind == 'S':
                 fits_fmt = np_size + 'A' 
@@ -440,21 +2369,471 @@ def write_fits_table(outfile, recarray, header={}, clobber=True,
                                      bscale=bscales.get(colname, None),
                                      bzero=bzeros.get(colname, None),
                                      disp=disps.get(colname, None)))
+    return coldefs
+
+def _update_header(header, values):
+    """Set the keywords in dict ``values`` in the pyfits ``header``."""
+    for hdr, val in values.items():
+        try:
+            header[hdr] = val
+        except KeyError:
+            # Older pyfits can only add new keywords with update()
+            header.update(hdr, val)
+
+def write_fits_table(outfile, recarray, header={}, clobber=True,
+                     units={}, nulls={}, bscales={}, bzeros={}, disps={}):
+    """Write ``recarray`` to a FITS binary table file.
+
+    NOTES:
+      - Set the binary table extension name with ``header['extname']``
+      - Vector and multi-dimensional column elements are supported.
+      - Use FitsTableWriter to write a table in chunks or append to a table.
+
+    :param outfile: output file name
+    :param recarray: input data (numpy record array)
+    :param header: dict of header keyword values
+    :param clobber: overwrite existing file (default True)
+    :param units: dict specifying column unit values
+    :param nulls: dict specifying column null values
+    :param bscales: dict specifying column bscale values
+    :param bzeros: dict specifying column bzero values
+    :param disps: dict specifying column disp values
+    :rtype: None
+
+    Dictionary-encoded columns of a table read with the ``categorical``
+    option are written as their values, which are expanded in chunks of rows.
+
+    Missing values of a numpy masked array are written as NaN in float
+    columns and as the column null value (TNULL) in integer columns, which is
+    taken from ``nulls`` or else is the smallest value of the FITS integer
+    type (the largest for unsigned bytes).  The ``nulls`` attribute of a table
+    read with ``null_fill`` gives the default null values.
+    """
+    import pyfits
+    nulls = dict(getattr(recarray, 'nulls', None) or {}, **nulls)
+    if isinstance(recarray, numpy.ma.MaskedArray):
+        recarray = _fill_masked(recarray, nulls)
+    categories = getattr(recarray, 'categories', None)
+    if categories:
+        chunk_rows = 100000
+        with FitsTableWriter(outfile, _decoded_dtype(recarray.dtype, categories), header,
+                             clobber, units=units, nulls=nulls, bscales=bscales,
+                             bzeros=bzeros, disps=disps) as writer:
+            for i in range(0, len(recarray), chunk_rows):
+                writer.write(decode_categories(recarray, (i, i + chunk_rows)))
+        return
+
+    coldefs = _fits_columns(recarray, units, nulls, bscales, bzeros, disps)
     
     cols=pyfits.ColDefs(coldefs)
     hdu0 = pyfits.PrimaryHDU()
     hdu1 = pyfits.new_table(cols)
-    for hdr, val in header.items():
-        hdu1.header.update(hdr, val)
+    _update_header(hdu1.header, header)
     hdulist = pyfits.HDUList([hdu0, hdu1]) 
 
-    # Temporarily redirect stdout to suppress the clobber warning message
-    # then actually write the file
+    # Remove an existing file here instead of letting pyfits do it, which avoids
+    # the clobber warning message
+    if clobber and os.path.exists(outfile):
+        os.remove(outfile)
+    hdulist.writeto(outfile)
+
+# Default null values of integer columns by numpy type, for the FITS integer
+# type each is written as (see _fits_columns)
+_fits_int_nulls = dict(u1=255, i1=-2**7, i2=-2**15, i4=-2**31, i8=-2**31)
+
+def _fill_masked(data, nulls):
+    """
+    Return a copy of the masked record array ``data`` with the missing values
+    of numeric columns replaced for writing to FITS, adding the null value of
+    each integer column with missing values to the dict ``nulls``.  The
+    ``categories`` of dictionary-encoded columns are kept.
+    """
+    out = data.data.copy().view(numpy.recarray)
+    categories = getattr(data, 'categories', None)
+    if categories:
+        out.categories = categories
+    for name in out.dtype.names:
+        mask = numpy.ma.getmaskarray(data[name])
+        if not mask.any() or name in (categories or ()):
+            continue
+        col = out[name]
+        if col.dtype.kind in 'fc':
+            col[mask] = numpy.nan
+        elif col.dtype.kind in 'iu':
+            null = nulls.setdefault(name, _fits_int_nulls.get(col.dtype.str[1:]))
+            if null is not None:
+                col[mask] = null
+    return out
+
+def _check_fits_column(name, col, dtype, casting='same_kind'):
+    """
+    Raise ValueError if the values of array ``col`` cannot be stored in FITS
+    column ``name`` of numpy type ``dtype`` without being changed (a different
+    kind of type, strings that are too long, or numbers out of range).
+    """
+    if not (col.dtype.kind in 'biu' and dtype.kind in 'iu'
+            or numpy.can_cast(col.dtype, dtype, casting)):
+        raise ValueError('Column %r of type %s cannot be written as type %s'
+                         % (name, col.dtype, dtype))
+    if col.size == 0:
+        return
+    if dtype.kind == 'S':
+        if col.dtype.itemsize > dtype.itemsize:
+            width = numpy.char.str_len(col).max()
+            if width > dtype.itemsize:
+                raise ValueError('Column %r has a value of %d characters, longer than %s'
+                                 % (name, width, dtype))
+    elif dtype.kind in 'iu':
+        if col.dtype.kind == 'f' and not numpy.all(numpy.isfinite(col)):
+            raise ValueError('Column %r has non-finite values for integer type %s'
+                             % (name, dtype))
+        info = numpy.iinfo(dtype)
+        if int(col.min()) < info.min or int(col.max()) > info.max:
+            raise ValueError('Column %r has values outside the range of %s' % (name, dtype))
+    elif dtype.kind == 'f' and col.dtype.kind == 'f' and col.dtype.itemsize > dtype.itemsize:
+        finite = numpy.abs(col[numpy.isfinite(col)])
+        if len(finite) and finite.max() > numpy.finfo(dtype).max:
+            raise ValueError('Column %r has values outside the range of %s' % (name, dtype))
+
+class FitsTableWriter(object):
+    """
+    Write a FITS binary table in chunks, for tables that are bigger than memory
+    or that grow over time.  The header is written once, then each record array
+    chunk passed to ``write()`` is converted to big-endian FITS format and
+    appended to the file.  ``close()`` pads the data and sets NAXIS2 to the
+    final number of rows.  Example::
+
+      with FitsTableWriter('out.fits', header={'extname': 'EVENTS'}) as writer:
+          for chunk in read_ascii_table_chunks('events.dat'):
+              writer.write(chunk)
+
+    With ``append=True`` rows are added to binary table HDU ``hdunum`` of an
+    existing file, which must be the last HDU of the file and have no
+    variable-length array columns.
+
+    Column formats are as for write_fits_table.  For a new file the columns are
+    defined by ``dtype``, or by the first chunk if ``dtype`` is None.
+
+    :param outfile: output file name
+    :param dtype: numpy dtype of the table rows (default=None => dtype of first chunk)
+    :param header: dict of header keyword values (new file only)
+    :param clobber: overwrite existing file (default True)
+    :param append: append rows to an existing table
+    :param hdunum: HDU number of the table when appending (default=1)
+    :param units: dict specifying column unit values
+    :param nulls: dict specifying column null values
+    :param bscales: dict specifying column bscale values
+    :param bzeros: dict specifying column bzero values
+    :param disps: dict specifying column disp values
+    """
+    def __init__(self, outfile, dtype=None, header={}, clobber=True, append=False,
+                 hdunum=1, units={}, nulls={}, bscales={}, bzeros={}, disps={}):
+        self.outfile = outfile
+        self.nrows = 0
+        self._header = header
+        self._clobber = clobber
+        self._column_opts = dict(units=units, nulls=nulls, bscales=bscales,
+                                 bzeros=bzeros, disps=disps)
+        self._fh = None
+        self._closed = False
+        if append:
+            self._open(hdunum)
+        elif dtype is not None:
+            self._create(numpy.zeros(0, dtype=dtype))
+
+    def _create(self, recarray):
+        """Write the primary HDU and the binary table header with no rows."""
+        import pyfits
+        cols = pyfits.ColDefs(_fits_columns(recarray, **self._column_opts))
+        hdu1 = pyfits.new_table(cols)
+        _update_header(hdu1.header, self._header)
+        if self._clobber and os.path.exists(self.outfile):
+            os.remove(self.outfile)
+        pyfits.HDUList([pyfits.PrimaryHDU(), hdu1]).writeto(self.outfile)
+        self._open(1)
+
+    def _open(self, hdunum):
+        """Open table HDU ``hdunum`` for appending rows after its current data."""
+        import pyfits
+        hdulist = pyfits.open(self.outfile)
+        try:
+            hdu = hdulist[hdunum]
+            if not isinstance(hdu, pyfits.BinTableHDU):
+                raise ValueError('HDU %d of %s is not a binary table' % (hdunum, self.outfile))
+            if hdunum != len(hdulist) - 1:
+                raise ValueError('Can only append to the last HDU of %s' % self.outfile)
+            if hdu.header.get('PCOUNT', 0):
+                raise ValueError('Cannot append to a table with variable-length arrays')
+            info = hdulist.fileinfo(hdunum)
+            header_loc, data_loc = info['hdrLoc'], info['datLoc']
+            self.nrows = hdu.header['NAXIS2']
+            rowbytes = hdu.header['NAXIS1']
+            self._naxis2_comment = hdu.header.comments['NAXIS2']
+            self._file_dtype = hdu.columns.dtype.newbyteorder('>')
+            self._bool_cols = set(col.name for col in hdu.columns
+                                  if str(col.format).strip().endswith('L'))
+            self._scales = dict((col.name, (col.bscale or 1, col.bzero or 0))
+                                for col in hdu.columns
+                                if col.bscale is not None or col.bzero is not None)
+        finally:
+            hdulist.close()
+        if self._file_dtype.itemsize != rowbytes:
+            raise ValueError('Table row layout of %s is not supported' % self.outfile)
+
+        self._fh = open(self.outfile, 'r+b')
+        self._fh.seek(header_loc)
+        cards = self._fh.read(data_loc - header_loc)
+        for i in range(0, len(cards), 80):
+            if cards[i:i+8] == 'NAXIS2  ':
+                self._naxis2_loc = header_loc + i
+                break
+        else:
+            raise ValueError('No NAXIS2 card found in %s' % self.outfile)
+
+        # Drop the padding after the existing rows, new rows go from there
+        self._fh.truncate(data_loc + rowbytes * self.nrows)
+        self._fh.seek(0, 2)
+
+    def write(self, chunk):
+        """
+        Append the rows of record array ``chunk`` to the table.  Raises
+        ValueError if a column cannot be stored in the table column type
+        without changing its values.
+        """
+        if self._closed:
+            raise ValueError('FitsTableWriter is closed')
+        if self._fh is None:
+            self._create(chunk[:0])
+        names = self._file_dtype.names
+        if set(chunk.dtype.names) != set(names):
+            raise ValueError('Chunk columns %s do not match table columns %s'
+                             % (chunk.dtype.names, names))
+
+        out = numpy.empty(len(chunk), dtype=self._file_dtype)
+        for name in names:
+            col = chunk[name]
+            if name in self._bool_cols:
+                col = numpy.where(col, ord('T'), ord('F'))
+            elif name in self._scales:
+                if col.dtype.kind not in 'biuf':
+                    raise ValueError('Column %r of type %s cannot be written as a scaled column'
+                                     % (name, col.dtype))
+                bscale, bzero = self._scales[name]
+                col = (col - bzero) / float(bscale)
+                if out[name].dtype.kind in 'iu':
+                    col = numpy.round(col)
+                _check_fits_column(name, col, out[name].dtype, casting='unsafe')
+            else:
+                _check_fits_column(name, col, out[name].dtype)
+            out[name] = col
+        out.tofile(self._fh)
+        self.nrows += len(chunk)
+
+    def close(self):
+        """Pad the table data and set the final number of rows in the header."""
+        if self._closed or self._fh is None:
+            self._closed = True
+            return
+        import pyfits
+        self._fh.write('\0' * (-self._fh.tell() % 2880))
+        self._fh.seek(self._naxis2_loc)
+        self._fh.write(pyfits.Card('NAXIS2', self.nrows, self._naxis2_comment).image)
+        self._fh.close()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _text_chunks(data, chunk_rows):
+    """
+    Return an iterator over the record array chunks of ``data``, which is a
+    record array (split into chunks of ``chunk_rows`` rows) or an iterable of
+    record arrays.  Dictionary-encoded columns are expanded to their values.
+    """
+    if not isinstance(data, numpy.ndarray):
+        return (decode_categories(chunk) if getattr(chunk, 'categories', None) else chunk
+                for chunk in data)
+    if getattr(data, 'categories', None):
+        return (decode_categories(data, (i, i + chunk_rows))
+                for i in range(0, len(data), chunk_rows))
+    return (data[i:i + chunk_rows] for i in range(0, len(data), chunk_rows))
+
+def _format_text_column(name, col):
+    """
+    Return the values of column ``name`` as a list of strings.  Floats are
+    formatted in bulk by numpy with the shortest repr that reads back exactly.
+    """
+    if col.ndim != 1 or col.dtype.kind not in 'biufS':
+        raise ValueError('Column %r with dtype %s cannot be written as text'
+                         % (name, col.dtype))
+    col = numpy.ma.getdata(col)
+    if col.dtype.kind in 'iu':
+        return map(str, col.tolist())
+    if col.dtype.kind != 'S':
+        col = col.astype('S')
+    return col.tolist()
+
+def _null_text_values(name, col, values, null_value):
+    """
+    Replace the missing values of the masked column ``name`` (``col``) in the
+    list of strings ``values`` by ``null_value``, raising ValueError if it
+    is None.  Returns ``values``.
+    """
+    mask = numpy.ma.getmask(col)
+    if mask is numpy.ma.nomask or not mask.any():
+        return values
+    if null_value is None:
+        raise ValueError('Column %r has missing values, set null_value to write them' % name)
+    for i in numpy.flatnonzero(mask):
+        values[i] = null_value
+    return values
+
+def _quoted_values(values, delimiter, quotechar, quoting):
+    """
+    Return the list of strings ``values`` with the values that need it quoted
+    (all values for ``quoting='all'``), doubling any quotechar inside.  With
+    ``quoting='minimal'`` these are the empty values and values containing
+    the delimiter, a quote, a line break or (for a space or tab delimiter)
+    white space, or starting with ``#``.
+    """
+    if quoting == 'none':
+        return values
+    if quoting == 'all':
+        need = values
+    else:
+        specials = set([delimiter, _dq, _sq, '\n', '\r'])
+        if delimiter in ' \t':
+            specials.update(' \t')
+        # Check the whole column at once, which is the common case of no
+        # value needing quotes, before finding the values to quote
+        joined = '\0' + '\0'.join(values) + '\0'
+        if not (any(char in joined for char in specials)
+                or '\0\0' in joined or '\0#' in joined):
+            return values
+        re_special = re.compile('[%s]' % re.escape(''.join(specials)))
+        need = [x for x in values if not x or x.startswith('#') or re_special.search(x)]
+    quoted = dict((x, quotechar + x.replace(quotechar, 2 * quotechar) + quotechar)
+                  for x in set(need))
+    return [quoted.get(x, x) for x in values]
+
+def _write_text_table(outfile, data, chunk_rows, header, format_columns):
+    """
+    Write the chunks of ``data`` to ``outfile`` (file name or file object),
+    starting with the lines returned by ``header(dtype)``.  Each chunk is
+    formatted as a list of lines by ``format_columns(chunk)`` and written as
+    one block.
+    """
+    chunks = _text_chunks(data, chunk_rows)
+    first = next(chunks, None)
+    if first is None:
+        if not isinstance(data, numpy.ndarray):
+            raise ValueError('No table chunks to write')
+        first = data[:0]
+
+    fh = open(outfile, 'w') if isinstance(outfile, basestring) else outfile
     try:
-        _sys_stdout = sys.stdout
-        sys.stdout = _NullFile()
-        hdulist.writeto(outfile, clobber=clobber)
+        fh.write(''.join(line + '\n' for line in header(first.dtype)))
+        for chunk in itertools.chain([first], chunks):
+            lines = format_columns(chunk)
+            if lines:
+                fh.write('\n'.join(lines) + '\n')
     finally:
-        sys.stdout = _sys_stdout
+        if fh is not outfile:
+            fh.close()
+
+def write_ascii_table(outfile, data, delimiter=' ', quotechar=_dq, quoting='minimal',
+                      chunk_rows=100000, null_value=None):
+    """
+    Write ``data`` to an ASCII table file with a header row of column names
+    that read_ascii_table reads back.  Each chunk of rows is formatted column
+    by column, with numpy formatting the numbers in bulk, and written as one
+    block.  Example::
+
+      write_ascii_table('events.dat', read_fits_table('events.fits'), delimiter=',')
+
+    Int, float and string columns read back with the same values and with
+    the int, float and string types of read_ascii_table (other numeric types
+    need the ``dtype`` or ``schema`` option).  Strings that would read back
+    as numbers or that have leading or trailing spaces do not round-trip.
+    Dictionary-encoded columns are written as their values.
+
+    The missing values of a masked array (e.g. read with the ``null_values``
+    option) are written as ``null_value``, quoted as for a string value, and
+    read back as missing with ``null_values=[null_value]``.  Missing values
+    raise ValueError if ``null_value`` is None.
+
+    :param outfile: output file name or file object
+    :param data: numpy record array or iterable of record array chunks
+    :param delimiter: single character column delimiter
+    :param quotechar: quote character (single or double quote)
+    :param quoting: quote string values as needed ('minimal'), 'all' or 'none'
+    :param chunk_rows: number of rows formatted and written at a time
+    :param null_value: string written for missing values of a masked array
+    :rtype: None
+    """
+    if len(delimiter) != 1:
+        raise ValueError('delimiter must be a single character')
+    if quotechar not in (_dq, _sq):
+        raise ValueError('quotechar must be a single or double quote')
+    if quoting not in ('minimal', 'all', 'none'):
+        raise ValueError("quoting must be 'minimal', 'all' or 'none'")
+    if null_value is not None:
+        null_value = _quoted_values([null_value], delimiter, quotechar, quoting)[0]
+
+    def header(dtype):
+        return [delimiter.join(_quoted_values(list(dtype.names or ()), delimiter, quotechar,
+                                              quoting))]
+
+    def format_columns(chunk):
+        cols = []
+        for name in chunk.dtype.names:
+            col = _format_text_column(name, chunk[name])
+            if chunk[name].dtype.kind == 'S':
+                col = _quoted_values(col, delimiter, quotechar, quoting)
+            cols.append(_null_text_values(name, chunk[name], col, null_value))
+        return map(delimiter.join, zip(*cols))
+
+    _write_text_table(outfile, data, chunk_rows, header, format_columns)
+
+def write_rdb_table(outfile, data, chunk_rows=100000, null_value=None):
+    """
+    Write ``data`` to an RDB table file: tab-separated column names, then the
+    column types (``N`` for numeric and ``S`` for string columns) and then the
+    rows with no quoting.  Chunks of rows are formatted as for
+    write_ascii_table.  Int, float and string columns read back through
+    read_rdb_table (or read_ascii_table with ``headerrow=1, datastart=3``)
+    with the same values and types.  A string value containing a tab or line
+    break raises ValueError.  The missing values of a masked array are
+    written as ``null_value`` (e.g. ``'NA'``, since an empty field at the
+    start or end of a line does not read back) as for write_ascii_table, and
+    read back with read_ascii_table and the ``null_values`` option.
+
+    :param outfile: output file name or file object
+    :param data: numpy record array or iterable of record array chunks
+    :param chunk_rows: number of rows formatted and written at a time
+    :param null_value: string written for missing values of a masked array
+    :rtype: None
+    """
+    if null_value is not None and (not null_value or set('\t\n\r') & set(null_value)):
+        raise ValueError('null_value must be a non-empty string with no tab or line break')
+
+    def header(dtype):
+        return ['\t'.join(dtype.names or ()),
+                '\t'.join('N' if dtype[i].kind in 'iuf' else 'S' for i in range(len(dtype)))]
 
+    def format_columns(chunk):
+        cols = []
+        for name in chunk.dtype.names:
+            col = _format_text_column(name, chunk[name])
+            if chunk[name].dtype.kind == 'S':
+                joined = '\0'.join(col)
+                for char in '\t\n\r':
+                    if char in joined:
+                        raise ValueError('Column %r has a value containing %r' % (name, char))
+            cols.append(_null_text_values(name, chunk[name], col, null_value))
+        return map('\t'.join, zip(*cols))
 
+    _write_text_table(outfile, data, chunk_rows, header, format_columns)
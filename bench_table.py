@@ -0,0 +1,307 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Benchmarks for the Ska.Table read and write paths.
+
+Synthetic tables are generated in a temporary directory for each combination
+of row count, layout (narrow or wide) and format (ASCII with each supported
+delimiter, quoted strings or aligned columns, RDB and FITS with
+multi-dimensional columns).  Each
+reader or writer is timed in a separate process, recording throughput (rows/s
+and MB/s of file data) and peak memory.
+
+Examples::
+
+  # Run and save a baseline
+  python bench_table.py --rows 1000 100000 --save bench_baseline.json
+
+  # Run again and fail if any case is more than 20% slower than the baseline
+  python bench_table.py --rows 1000 100000 --compare bench_baseline.json --threshold 0.2
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import resource
+import argparse
+import Queue
+import tempfile
+import multiprocessing
+
+import numpy
+
+import Ska.Table
+
+LAYOUTS = {'narrow': 5, 'wide': 50}
+DELIMITERS = {'pipe': '|', 'amp': '&', 'comma': ',', 'tab': '\t', 'space': ' '}
+
+
+def make_recarray(nrows, ncols, multidim=False):
+    """
+    Make a record array with ``ncols`` columns cycling through int, float and
+    string types (and 2-d float columns if ``multidim``).
+    """
+    rand = numpy.random.RandomState(0)
+    cols = []
+    for i in range(ncols):
+        kind = i % 4 if multidim else i % 3
+        if kind == 0:
+            col = rand.randint(-100000, 100000, nrows)
+        elif kind == 1:
+            col = rand.normal(size=nrows)
+        elif kind == 2:
+            col = numpy.array(['str%d' % x for x in rand.randint(0, 1000, nrows)])
+        else:
+            col = rand.normal(size=(nrows, 3, 4))
+        cols.append(('col%d' % i, col))
+
+    data = numpy.recarray(nrows, dtype=[(name, col.dtype, col.shape[1:])
+                                        for name, col in cols])
+    for name, col in cols:
+        data[name] = col
+    return data
+
+
+def write_ascii(filename, data, delimiter, quoted=False):
+    """Write ``data`` as an ASCII table, optionally quoting string values."""
+    with open(filename, 'w') as fh:
+        fh.write(delimiter.join(data.dtype.names) + '\n')
+        for row in data.tolist():
+            vals = [("'%s v'" % x if quoted else x) if isinstance(x, str) else repr(x)
+                    for x in row]
+            fh.write(delimiter.join(vals) + '\n')
+
+
+def write_aligned(filename, data):
+    """Write ``data`` as an ASCII table with space separated fixed-width columns."""
+    cols = [[x if isinstance(x, str) else repr(x) for x in data[name].tolist()]
+            for name in data.dtype.names]
+    widths = [max(len(x) for x in col) if col else 1 for col in cols]
+    with open(filename, 'w') as fh:
+        fh.write(' '.join(data.dtype.names) + '\n')
+        for row in zip(*cols):
+            fh.write(' '.join(x.rjust(width) for x, width in zip(row, widths)) + '\n')
+
+
+def write_rdb(filename, data):
+    """Write ``data`` as an RDB table."""
+    with open(filename, 'w') as fh:
+        fh.write('\t'.join(data.dtype.names) + '\n')
+        fh.write('\t'.join('S' if data.dtype[i].kind == 'S' else 'N'
+                           for i in range(len(data.dtype))) + '\n')
+        for row in data.tolist():
+            fh.write('\t'.join(str(x) for x in row) + '\n')
+
+
+def make_cases(rows, layouts, tmpdir, match=None):
+    """
+    Generate the benchmark cases whose name contains ``match`` as (name,
+    function, args, nrows, nbytes), writing their input tables in ``tmpdir``
+    as needed.  ``nbytes`` is the file size used for the MB/s throughput.
+    """
+    for nrows in rows:
+        for layout in layouts:
+            ncols = LAYOUTS[layout]
+            tag = '%s-%d' % (layout, nrows)
+            files = {}
+
+            def wanted(name):
+                return not match or match in name
+
+            def table_file(kind, write, *args):
+                # Write each input table only once and only if some case needs it
+                if kind not in files:
+                    filename = os.path.join(tmpdir, '%s-%s' % (kind, tag))
+                    write(filename, *args)
+                    files[kind] = filename
+                return files[kind], os.path.getsize(files[kind])
+
+            data = make_recarray(nrows, ncols)
+            for dname, delimiter in sorted(DELIMITERS.items()):
+                name = 'read_ascii_table/%s/%s' % (dname, tag)
+                if wanted(name):
+                    filename, nbytes = table_file(dname + '.txt', write_ascii, data, delimiter)
+                    yield name, Ska.Table.read_ascii_table, (filename,), nrows, nbytes
+
+            name = 'read_ascii_table/quoted/%s' % tag
+            if wanted(name):
+                filename, nbytes = table_file('quoted.txt', write_ascii, data, ' ', True)
+                yield name, Ska.Table.read_ascii_table, (filename,), nrows, nbytes
+
+            name = 'read_ascii_table/aligned/%s' % tag
+            if wanted(name):
+                filename, nbytes = table_file('aligned.txt', write_aligned, data)
+                yield name, Ska.Table.read_ascii_table, (filename,), nrows, nbytes
+
+            name = 'read_ascii_table_chunks/space/%s' % tag
+            if wanted(name):
+                filename, nbytes = table_file('space.txt', write_ascii, data, ' ')
+                yield name, _read_chunks, (filename,), nrows, nbytes
+
+            name = 'read_rdb_table/%s' % tag
+            if wanted(name):
+                filename, nbytes = table_file('table.rdb', write_rdb, data)
+                yield name, Ska.Table.read_rdb_table, (filename,), nrows, nbytes
+
+            for name, func, kind in (
+                    ('write_ascii_table/%s' % tag, Ska.Table.write_ascii_table, 'written.txt'),
+                    ('write_rdb_table/%s' % tag, Ska.Table.write_rdb_table, 'written.rdb')):
+                if wanted(name):
+                    filename, nbytes = table_file(kind, func, data)
+                    yield name, func, (filename + '.out', data), nrows, nbytes
+
+            fits_data = make_recarray(nrows, ncols, multidim=True)
+            for name, func in (('read_fits_table/%s' % tag, Ska.Table.read_fits_table),
+                               ('write_fits_table/%s' % tag, _write_fits),
+                               ('FitsTableWriter/%s' % tag, _write_fits_chunks)):
+                if wanted(name):
+                    filename, nbytes = table_file('table.fits', Ska.Table.write_fits_table,
+                                                  fits_data)
+                    if func is Ska.Table.read_fits_table:
+                        yield name, func, (filename,), nrows, nbytes
+                    else:
+                        yield name, func, (filename + '.out', fits_data), nrows, nbytes
+
+
+def _read_chunks(filename):
+    for chunk in Ska.Table.read_ascii_table_chunks(filename, chunk_rows=100000):
+        pass
+
+
+def _write_fits(filename, data):
+    Ska.Table.write_fits_table(filename, data)
+
+
+def _write_fits_chunks(filename, data):
+    with Ska.Table.FitsTableWriter(filename, dtype=data.dtype) as writer:
+        for i in range(0, len(data), 100000):
+            writer.write(data[i:i + 100000])
+
+
+def _maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _run_in_child(func, args, queue):
+    try:
+        rss0 = _maxrss_mb()
+        t0 = time.time()
+        func(*args)
+        queue.put((None, time.time() - t0, _maxrss_mb() - rss0))
+    except BaseException, err:
+        queue.put(('%s: %s' % (err.__class__.__name__, err), None, None))
+
+
+def run_case(func, args, nrows, nbytes, timeout=3600):
+    """
+    Run ``func(*args)`` in a child process and return a dict of seconds,
+    rows_per_s, mb_per_s and peak_mb (increase of the peak resident memory).
+    Raise BenchmarkError if the case raises an exception, the child process
+    dies or no result arrives within ``timeout`` seconds.
+    """
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run_in_child, args=(func, args, queue))
+    proc.start()
+    try:
+        # Poll so that a child that dies without a result is noticed
+        t0 = time.time()
+        while True:
+            try:
+                error, seconds, peak_mb = queue.get(timeout=1)
+                break
+            except Queue.Empty:
+                if not proc.is_alive() and queue.empty():
+                    raise BenchmarkError('process exited with code %s' % proc.exitcode)
+                if time.time() - t0 > timeout:
+                    raise BenchmarkError('no result after %d s' % timeout)
+    finally:
+        if proc.is_alive():
+            proc.join(1)
+        if proc.is_alive():
+            proc.terminate()
+        proc.join()
+    if error is not None:
+        raise BenchmarkError(error)
+    return dict(seconds=seconds,
+                rows_per_s=nrows / seconds,
+                mb_per_s=nbytes / 1e6 / seconds,
+                peak_mb=peak_mb)
+
+
+def run_benchmarks(rows=(1000, 10000, 100000), layouts=('narrow', 'wide'), match=None,
+                   out=sys.stdout):
+    """
+    Run all benchmark cases whose name contains ``match`` and return a dict of
+    results keyed by case name.  Raise BenchmarkError naming the first case
+    that fails.
+    """
+    tmpdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name, func, args, nrows, nbytes in make_cases(rows, layouts, tmpdir, match):
+            try:
+                results[name] = run_case(func, args, nrows, nbytes)
+            except BenchmarkError, err:
+                raise BenchmarkError('%s failed: %s' % (name, err))
+            if out:
+                print >>out, ('%-45s %8.3f s %12.0f rows/s %8.2f MB/s %8.1f MB'
+                              % (name, results[name]['seconds'], results[name]['rows_per_s'],
+                                 results[name]['mb_per_s'], results[name]['peak_mb']))
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Return the list of (name, seconds, baseline seconds) for cases in both
+    ``results`` and ``baseline`` that are more than ``threshold`` (fraction)
+    slower than the baseline.
+    """
+    slower = []
+    for name in sorted(set(results) & set(baseline)):
+        seconds = results[name]['seconds']
+        base_seconds = baseline[name]['seconds']
+        if seconds > base_seconds * (1 + threshold):
+            slower.append((name, seconds, base_seconds))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Ska.Table readers and writers')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Table row counts (up to 1e7)')
+    parser.add_argument('--layouts', nargs='+', default=sorted(LAYOUTS),
+                        choices=sorted(LAYOUTS), help='Table layouts')
+    parser.add_argument('--match', help='Only run cases whose name contains this string')
+    parser.add_argument('--save', help='Save results as a JSON baseline file')
+    parser.add_argument('--compare', help='Compare results with a JSON baseline file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed slowdown fraction relative to the baseline')
+    args = parser.parse_args(argv)
+
+    try:
+        results = run_benchmarks(args.rows, args.layouts, args.match)
+    except BenchmarkError, err:
+        print >>sys.stderr, 'FAILED %s' % err
+        return 2
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        slower = compare(results, baseline, args.threshold)
+        for name, seconds, base_seconds in slower:
+            print 'SLOWER %-45s %8.3f s (baseline %8.3f s)' % (name, seconds, base_seconds)
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,17 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from Ska.Table import read_table, read_ascii_table, read_fits_table, read_vots_table
+from Ska.Table import read_ascii_table_chunks, ParseTableError, TableCache
+from Ska.Table import read_tables, ReadTablesError, write_fits_table, read_rdb_table
+from Ska.Table import FitsTableWriter, read_fits_tables, read_fits_headers
+from Ska.Table import read_vots_table_chunks, category_code, decode_categories
+from Ska.Table import write_ascii_table, write_rdb_table, concatenate_tables
+import sys
+import numpy
 import unittest
+import gzip
+import bz2
+import shutil
+import os
 from tempfile import mkdtemp
 
 cols = {}
@@ -94,5 +105,573 @@ class TestConvert(unittest.TestCase):
                                  colnames=colnames)
         self.assertEqual(data.dtype.names, colnames)
 
+    def test5_ascii_dtypes(self):
+        data = read_ascii_table(['a b c d', '1 2.5 x 99999999999999999999',
+                                 '-3 4 yy 1'])
+        self.assertEqual([data.dtype[i].kind for i in range(4)],
+                         ['i', 'f', 'S', 'O'])
+        self.assertEqual(data['c'].dtype.itemsize, 2)
+        self.assertEqual(data['a'].tolist(), [1, -3])
+        self.assertEqual(data['d'].tolist(), [99999999999999999999, 1])
+        data = read_ascii_table(['a b', '1 99999999999999999999', '2 1.5'])
+        self.assertEqual([data.dtype[i].kind for i in range(2)], ['i', 'f'])
+        # Integers in the uint64 range give the dtypes of numpy.rec.fromrecords
+        for values, kind in ((['9223372036854775808'], 'u'),
+                             (['1', '9999999999999999999'], 'f'),
+                             (['-1', '9999999999999999999'], 'f')):
+            self.assertEqual(read_ascii_table(['a'] + values)['a'].dtype.kind, kind)
+        # Not the last value
+        data = read_ascii_table(['a', '1', '99999999999999999999', '2'])
+        self.assertEqual(data['a'].tolist(), [1, 99999999999999999999, 2])
+        self.assertRaises(ParseTableError, read_ascii_table,
+                          ['a', '1', '99999999999999999999', '2'], dtype=int)
+
+    def test6_ascii_sniff_sample(self):
+        full = read_ascii_table('t/test4.dat', sniff_lines=0)
+        data = read_ascii_table('t/test4.dat', sniff_lines=10)
+        self.assertEqual(data.dtype, full.dtype)
+        self.assertEqual(data.tolist(), full.tolist())
+        # Sniffed ',' dialect is contradicted by a line outside the sample
+        data = read_ascii_table(['a,b c', '1,2 3', '4,5 6', '7,8,9 x'],
+                                sniff_lines=2)
+        self.assertEqual(data.parse_table_dialect.delimiter, ' ')
+        self.assertEqual(data.dtype.names, ('a,b', 'c'))
+
+    def test7_ascii_chunks(self):
+        full = read_ascii_table('t/test4.dat')
+        chunks = list(read_ascii_table_chunks('t/test4.dat', chunk_rows=500,
+                                              sniff_lines=20))
+        self.assertEqual([len(x) for x in chunks], [500, 500, 172])
+        self.assertEqual(set(x.dtype for x in chunks), set([full.dtype]))
+        self.assertEqual(numpy.concatenate(chunks).tolist(), full.tolist())
+
+        lines = ['a b'] + ['%d x' % i for i in range(10)] + ['1.5 yyy']
+        chunks = read_ascii_table_chunks(lines, chunk_rows=4, sniff_lines=5)
+        self.assertRaises(ParseTableError, list, chunks)
+        chunks = list(read_ascii_table_chunks(lines, chunk_rows=4, sniff_lines=5,
+                                              widen=True))
+        self.assertEqual(chunks[-1].dtype.descr, [('a', '<f8'), ('b', '|S3')])
+        self.assertEqual(chunks[-1]['a'].tolist(), [8, 9, 1.5])
+
+        # Integers beyond uint64 are python ints as for read_ascii_table
+        lines = ['a', '99999999999999999999'] + [str(i) for i in range(9)] + ['1.5']
+        chunks = list(read_ascii_table_chunks(lines, chunk_rows=4, sniff_lines=2,
+                                              widen=True))
+        self.assertEqual(chunks[1].dtype['a'], numpy.dtype(object))
+        self.assertEqual(chunks[1]['a'].tolist(), [3, 4, 5, 6])
+        self.assertEqual(chunks[2]['a'].tolist(), [7, 8, 1.5])
+
+    def test8_fits_native_modes(self):
+        full = read_fits_table('t/multi.fits')
+        lazy = read_fits_table('t/multi.fits', native='lazy')
+        self.assertEqual(lazy.colnames, full.dtype.names)
+        self.assertEqual(lazy._columns, {})
+        self.assertTrue(lazy['NET'].dtype.isnative)
+        self.assertTrue(numpy.all(lazy.field('NET') == full['NET']))
+        self.assertEqual(list(lazy._columns), ['NET'])
+        self.assertEqual(lazy.dtype, full.dtype)
+        raw = read_fits_table('t/multi.fits', native='raw')
+        self.assertFalse(raw['NET'].dtype.isnative)
+        self.assertTrue(numpy.all(raw['NET'] == full['NET']))
+        self.assertRaises(ValueError, read_fits_table, 't/ascii_ephin.fits',
+                          native='raw')
+
+    def test9_columns_rows(self):
+        for f in ('t/ascii_ephin.fits', 't/test4.dat'):
+            full = read_table(f)
+            names = full.dtype.names
+            data = read_table(f, columns=[names[3], names[0]], rows=(5, 10))
+            self.assertEqual(data.dtype.names, (names[3], names[0]))
+            self.assertEqual(data.tolist(), full[[names[3], names[0]]][5:10].tolist())
+        data = read_fits_table('t/multi-dim.fits', columns=['aca_align'],
+                               native='raw')
+        self.assertEqual(data['aca_align'].shape, (1, 3, 3))
+        self.assertRaises(ValueError, read_table, 't/test4.dat', columns=['nope'])
+
+    def test10_table_cache(self):
+        cache_dir = mkdtemp()
+        cache = TableCache(cache_dir)
+        data = cache.read_table('t/short.rdb', headertype='rdb')
+        self.assertTrue(cache.read_table('t/short.rdb', headertype='rdb') is data)
+        cache.read_table('t/short.rdb')
+        self.assertEqual(cache.stats, dict(memory_hits=1, disk_hits=0, misses=2,
+                                           uncached=0))
+        cache2 = TableCache(cache_dir, max_memory=0)
+        for i in range(2):
+            data2 = cache2.read_table('t/short.rdb', headertype='rdb')
+        self.assertEqual(cache2.stats['disk_hits'], 2)
+        self.assertEqual(data2.tolist(), data.tolist())
+        self.assertEqual(data2.parse_table_dialect.delimiter, '\t')
+        cache2.read_table(['a b', '1 2'])
+        self.assertEqual(cache2.stats['uncached'], 1)
+        cache2.clear()
+        cache2.read_table('t/short.rdb', headertype='rdb')
+        self.assertEqual(cache2.stats['misses'], 1)
+        disk_hits = cache2.stats['disk_hits']
+        for i in range(2):
+            data = cache2.read_table('t/vots_spec.dat')
+        self.assertEqual(cache2.stats['disk_hits'], disk_hits + 1)
+        self.assertEqual(data.vots_header['param'].field('name').tolist(), ['version', 'date'])
+        shutil.rmtree(cache_dir)
+
+    def test11_read_tables(self):
+        paths = ['t/simple2.txt', 't/simple3.txt', 't/simple2.txt']
+        for pool in ('process', 'thread'):
+            tables = read_tables(paths, workers=2, pool=pool)
+            self.assertEqual([len(x) for x in tables], [3, 2, 3])
+            self.assertEqual(tables[1].colnames, tables[1].dtype.names)
+            self.assertEqual(str(tables[1].table_schema), str(read_table(paths[1]).table_schema))
+            data = read_tables(paths, workers=2, pool=pool, concatenate=True)
+            self.assertEqual(len(data), 8)
+            self.assertEqual(data['obsid'].tolist(),
+                             sum([x['obsid'].tolist() for x in tables], []))
+        data = read_tables([['a b', '1 x'], ['a b', '2.5 yy']], workers=1,
+                           concatenate=True)
+        self.assertEqual(data.dtype.descr, [('a', '<f8'), ('b', '|S2')])
+        self.assertEqual(data.tolist(), [(1.0, 'x'), (2.5, 'yy')])
+
+        # Empty column name
+        paths = ['t/nls1_stackinfo.dbout'] * 2
+        data = read_tables(paths, workers=2, concatenate=True, headerrow=1, datastart=3)
+        self.assertEqual(data.dtype.names, cols[paths[0]])
+        self.assertEqual(len(data), 2 * nrows[paths[0]])
+
+        self.assertRaises(ValueError, read_tables, paths, workers=2, lazy=True)
+        tables = read_tables(paths, workers=2, pool='thread', lazy=True, headerrow=1,
+                             datastart=3)
+        self.assertEqual(tables[0].colnames, cols[paths[0]])
+        try:
+            read_tables(['t/simple2.txt', 'file_doesnt_exist'], workers=2)
+        except ReadTablesError, err:
+            self.assertTrue('file_doesnt_exist' in str(err))
+        else:
+            self.fail('ReadTablesError not raised')
+
+    def test12_ascii_workers(self):
+        tmpdir = mkdtemp()
+        filename = os.path.join(tmpdir, 'table.txt')
+        with open(filename, 'w') as fh:
+            print >>fh, '# comment'
+            print >>fh, 'a b c d'
+            for i in range(300):
+                print >>fh, i, i * 0.5, (i if i < 250 else 'x%d' % i), (i if i < 200 else 2.5)
+                if i % 7 == 0:
+                    print >>fh, '# comment'
+        serial = read_ascii_table(filename)
+        for workers in (2, 3, 7):
+            data = read_ascii_table(filename, workers=workers, sniff_lines=10)
+            self.assertEqual(data.dtype, serial.dtype)
+            self.assertEqual(data.tolist(), serial.tolist())
+        data = read_ascii_table(filename, workers=3, columns=['d', 'c'])
+        self.assertEqual(data.tolist(), serial[['d', 'c']].tolist())
+        shutil.rmtree(tmpdir)
+
+        # Empty column name
+        opt = dict(headerrow=1, datastart=3)
+        serial = read_ascii_table('t/nls1_stackinfo.dbout', **opt)
+        data = read_ascii_table('t/nls1_stackinfo.dbout', workers=2, sniff_lines=10, **opt)
+        self.assertEqual(data.dtype, serial.dtype)
+        self.assertEqual(data.tolist(), serial.tolist())
+
+    def test13_format_dispatch(self):
+        stdout = sys.stdout
+        data = read_table('t/vots_spec.dat')
+        self.assertEqual(data.dtype.names, ('id', 'name', 'ra', 'dec', 'flux'))
+        self.assertEqual(data.vots_header['field'].field('name').tolist(),
+                         list(data.dtype.names))
+        self.assertRaises(ValueError, read_table, 't/short.rdb', format='xml')
+
+        # File objects are recognized from their first bytes
+        for f in ('t/multi.fits', 't/test4.dat', 't/vots_spec.dat'):
+            with open(f, 'rb') as fh:
+                self.assertEqual(read_table(fh).dtype, read_table(f).dtype)
+        self.assertTrue(sys.stdout is stdout)
+
+        tmpdir = mkdtemp()
+        filename = os.path.join(tmpdir, 'short.fits')
+        data = read_table('t/short.rdb', headertype='rdb')
+        for i in range(2):
+            write_fits_table(filename, data)
+        self.assertEqual(read_table(filename).tolist(), data.tolist())
+        self.assertTrue(sys.stdout is stdout)
+        shutil.rmtree(tmpdir)
+
+    def test14_read_rdb_table(self):
+        for f in ('t/short.rdb', 't/apostrophe.rdb'):
+            data = read_rdb_table(f)
+            self.assertEqual(data.dtype, read_ascii_table(f, headertype='rdb').dtype)
+            self.assertEqual(data.parse_table_dialect.delimiter, '\t')
+        lines = ['a\tb', 'N\tS'] + ['%d\t%d' % (i, i) for i in range(20)] + ['1.5\t2']
+        data = read_rdb_table(lines)
+        self.assertEqual(data.dtype.descr, [('a', '<f8'), ('b', '|S2')])
+        # Empty or non-numeric values leave a numeric column as strings
+        data = read_rdb_table(['a\tb\tc', 'S\tN\tS', 'y\t\tq', 'x\t1\tz'])
+        self.assertEqual(data.tolist(), [('y', '', 'q'), ('x', '1', 'z')])
+        data = read_rdb_table(lines[:2] + ['x\t1'])
+        self.assertEqual(data.tolist(), [('x', '1')])
+        self.assertRaises(ParseTableError, read_rdb_table, lines[:2] + ['1\t1\t1'])
+
+    def test15_fits_table_writer(self):
+        tmpdir = mkdtemp()
+        filename = os.path.join(tmpdir, 'chunks.fits')
+        data = numpy.zeros(100, dtype=[('a', 'i4'), ('b', 'f8', (2, 3)),
+                                       ('c', 'S3'), ('d', 'bool')]).view(numpy.recarray)
+        data['a'] = numpy.arange(100)
+        data['b'] = numpy.arange(600).reshape(100, 2, 3)
+        data['c'] = ['x%d' % i for i in range(100)]
+        data['d'] = data['a'] % 3 == 0
+        with FitsTableWriter(filename, header={'extname': 'CHUNKS'}) as writer:
+            for i in range(0, 60, 25):
+                writer.write(data[i:i + 25])
+        with FitsTableWriter(filename, append=True) as writer:
+            writer.write(data[75:])
+        self.assertEqual(writer.nrows, 100)
+        out = read_fits_table(filename)
+        self.assertEqual(os.path.getsize(filename) % 2880, 0)
+        for name in data.dtype.names:
+            self.assertTrue(numpy.all(out[name] == data[name]))
+
+        # Values that would be truncated or wrapped are rejected
+        with FitsTableWriter(filename, append=True) as writer:
+            for name, value in (('a', 2 ** 40), ('a', 1.7), ('c', 'abcdefg')):
+                bad = numpy.zeros(1, dtype=[('a', type(value) if name == 'a' else 'i4'),
+                                            ('b', 'f8', (2, 3)), ('c', 'S7'), ('d', 'bool')])
+                bad[name] = value
+                self.assertRaises(ValueError, writer.write, bad)
+            writer.write(data[:1].astype([('a', 'i8'), ('b', 'f8', (2, 3)),
+                                          ('c', 'S7'), ('d', 'bool')]))
+        out = read_fits_table(filename)
+        self.assertEqual(len(out), 101)
+        self.assertEqual((out['a'][-1], out['c'][-1]), (data['a'][0], data['c'][0]))
+        shutil.rmtree(tmpdir)
+
+    def test16_compressed(self):
+        tmpdir = mkdtemp()
+        for f in ('t/test4.dat', 't/multi.fits', 't/vots_spec.dat', 't/short.rdb'):
+            parseopt = opt.get(f, {})
+            data = read_table(f, **parseopt)
+            for ext, open_compressed in (('.gz', gzip.GzipFile), ('.bz2', bz2.BZ2File)):
+                filename = os.path.join(tmpdir, os.path.basename(f) + ext)
+                out = open_compressed(filename, 'wb')
+                out.write(open(f, 'rb').read())
+                out.close()
+                cdata = read_table(filename, **parseopt)
+                self.assertEqual(cdata.dtype, data.dtype)
+                for name in data.dtype.names:
+                    self.assertTrue(numpy.all(cdata[name] == data[name]))
+        shutil.rmtree(tmpdir)
+
+    def test17_benchmark_compare(self):
+        import bench_table
+        results = bench_table.run_benchmarks(rows=[100], layouts=['narrow'],
+                                             match='read_rdb', out=None)
+        self.assertEqual(results.keys(), ['read_rdb_table/narrow-100'])
+        self.assertTrue(results['read_rdb_table/narrow-100']['rows_per_s'] > 0)
+        # A case that raises fails instead of waiting for its result
+        self.assertRaises(bench_table.BenchmarkError, bench_table.run_case,
+                          os.listdir, ('file_doesnt_exist',), 1, 1)
+        baseline = {'read_rdb_table/narrow-100': dict(seconds=1e-9)}
+        self.assertEqual(len(bench_table.compare(results, baseline, 0.2)), 1)
+        self.assertEqual(bench_table.compare(results, results, 0.2), [])
+
+    def test18_read_stats(self):
+        data = read_table('t/test4.dat', profile=True)
+        stages = [x[0] for x in data.read_stats.stages]
+        for stage in ('open', 'read_lines', 'sniff', 'parse', 'convert', 'build'):
+            self.assertTrue(stage in stages)
+        self.assertEqual(data.read_stats.info['rows'], 1172)
+        self.assertEqual(data.read_stats.info['dialect'], str(data.parse_table_dialect))
+        self.assertFalse(hasattr(read_table('t/test4.dat'), 'read_stats'))
+
+        calls = []
+        data = read_table('t/multi.fits', profile=lambda *args: calls.append(args))
+        self.assertEqual([x[0] for x in calls], ['open', 'copy'])
+        self.assertEqual(data.read_stats.info['rows'], 1)
+
+    def test19_dtype_schema(self):
+        data = read_ascii_table('t/test4.dat')
+        schema = data.table_schema
+        self.assertEqual(schema.dtype, data.dtype)
+        again = read_ascii_table('t/test4.dat', schema=schema, profile=True)
+        self.assertEqual(again.dtype, data.dtype)
+        self.assertTrue(numpy.all(again == data))
+        stages = [x[0] for x in again.read_stats.stages]
+        self.assertFalse('sniff' in stages or 'dialect' in stages)
+
+        data = read_ascii_table('t/test4.dat', dtype=[('statname', 'S12'), ('p1.gamma', 'f4')])
+        self.assertEqual(data.dtype.names, ('statname', 'p1.gamma'))
+        self.assertEqual(data['p1.gamma'].dtype, numpy.float32)
+        self.assertEqual(read_table('t/short.tab', dtype=float)['n_obs'].dtype, numpy.float_)
+
+        self.assertRaises(ParseTableError, read_ascii_table, 't/short.tab', schema=schema)
+        self.assertRaises(ParseTableError, read_ascii_table, 't/test4.dat',
+                          dtype=[('statname', 'f8')])
+        self.assertRaises(ParseTableError, read_ascii_table, 't/test4.dat',
+                          dtype=[('statname', 'S3')])
+        self.assertRaises(ParseTableError, read_ascii_table, 't/short.tab',
+                          dtype=[('agasc_id', 'i2')])
+        self.assertRaises(ParseTableError, read_ascii_table, ['a', '1', '-1'],
+                          dtype=[('a', 'u8')])
+        self.assertRaises(ParseTableError, read_ascii_table, ['a', '1e39', '1'],
+                          dtype=[('a', 'f4')])
+        data = read_ascii_table(['a', 'inf', 'nan'], dtype=[('a', 'f4')])
+        self.assertTrue(numpy.isinf(data['a'][0]) and numpy.isnan(data['a'][1]))
+
+    def test20_lazy_ascii(self):
+        data = read_table('t/nls1_stackinfo.dbout')
+        lazy = read_table('t/nls1_stackinfo.dbout', lazy=True)
+        self.assertEqual(lazy.colnames, data.colnames)
+        self.assertEqual(len(lazy), len(data))
+        self.assertTrue(numpy.all(lazy['ra'] == data['ra']))
+        self.assertTrue(numpy.all(lazy.field('z') == data.field('z')))
+        self.assertEqual(sorted(lazy._columns), ['ra', 'z'])
+        self.assertEqual(lazy.dtype, data.dtype)
+        self.assertTrue(numpy.all(lazy.as_array() == data))
+
+        lazy = read_ascii_table('t/short.tab', lazy=True, dtype=float)
+        self.assertEqual(lazy.dtype.names, ('agasc_id', 'n_noids', 'n_obs'))
+        self.assertEqual(lazy._columns, {})
+        self.assertEqual(lazy['n_obs'].dtype, numpy.float_)
+
+    def test21_fits_key_range(self):
+        data = read_fits_table('t/ascii_ephin.fits')
+        time = data['TIME']
+        tmpdir = mkdtemp()
+        index = os.path.join(tmpdir, 'ephin.idx')
+        try:
+            # Search without the index, then building it, then using it
+            for key_index in (None, index, index):
+                for key_range in ((time[10], time[20]), (None, time[5]),
+                                  (time[100] + 0.1, None), (0, 1)):
+                    start = -numpy.inf if key_range[0] is None else key_range[0]
+                    stop = numpy.inf if key_range[1] is None else key_range[1]
+                    ok = (time >= start) & (time < stop)
+                    out = read_table('t/ascii_ephin.fits', key='TIME', key_range=key_range,
+                                     key_index=key_index)
+                    self.assertEqual(out.dtype, data.dtype)
+                    self.assertTrue(numpy.all(out == data[ok]))
+            self.assertTrue(os.path.exists(index))
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertRaises(ValueError, read_fits_table, 't/ascii_ephin.fits', key='TIME')
+        self.assertRaises(ValueError, read_fits_table, 't/ascii_ephin.fits', key='TIM',
+                          key_range=(0, 1))
+
+    def test22_read_fits_tables(self):
+        import pyfits
+        tmpdir = mkdtemp()
+        filename = os.path.join(tmpdir, 'multi.fits')
+        try:
+            melo = read_fits_table('t/multi.fits')
+            ephin = read_fits_table('t/ascii_ephin.fits')
+            pyfits.HDUList([pyfits.PrimaryHDU(),
+                            pyfits.BinTableHDU(melo, name='MELO'),
+                            pyfits.BinTableHDU(ephin, name='EPHIN')]).writeto(filename)
+
+            headers = read_fits_headers(filename)
+            self.assertEqual(headers.keys(), [0, 1, 2])
+            self.assertEqual(headers[2]['EXTNAME'], 'EPHIN')
+
+            tables = read_fits_tables(filename)
+            self.assertEqual(tables.keys(), [1, 2])
+            self.assertTrue(tables['ephin'] is tables[2])
+            self.assertEqual(tables.headers[1]['NAXIS2'], 1)
+            for table, data in ((tables[1], melo), (tables[2], ephin)):
+                self.assertEqual(table.dtype, data.dtype)
+                self.assertTrue(numpy.all(table == data))
+
+            tables = read_fits_tables(filename, hdus=['EPHIN'], columns=['TIME'], native='lazy')
+            self.assertEqual(tables.keys(), [2])
+            self.assertTrue(numpy.all(tables[2]['TIME'] == ephin['TIME']))
+            self.assertRaises(ValueError, read_fits_tables, filename, hdus=['NOPE'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test23_vots_datatypes(self):
+        header, data = read_vots_table('t/vots_spec.dat')
+        self.assertEqual([data[name].dtype for name in data.dtype.names],
+                         [numpy.int32, 'S20', numpy.float64, numpy.float64, numpy.float32])
+        self.assertEqual(data['name'][1], 'CXOCS J193322+024444')
+        header, inferred = read_vots_table('t/vots_spec.dat', datatypes=False)
+        self.assertEqual(inferred['flux'].dtype, numpy.float64)
+        self.assertTrue(numpy.all(inferred['id'] == data['id']))
+
+        header, chunks = read_vots_table_chunks('t/vots_spec.dat', chunk_rows=2)
+        self.assertEqual(header['field'].field('name').tolist(), list(data.dtype.names))
+        chunks = list(chunks)
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertTrue(numpy.all(numpy.concatenate(chunks) == data))
+
+        header_lines = [x for x in open('t/vots_spec.dat') if x.startswith('#')]
+        self.assertRaises(ParseTableError, read_vots_table, header_lines + ['1.5 a 2 3 4'])
+
+    def test24_fixed_width(self):
+        tmpdir = mkdtemp()
+        filename = os.path.join(tmpdir, 'aligned.txt')
+        try:
+            with open(filename, 'w') as fh:
+                print >>fh, 'id name x flag'
+                for i in range(3000):
+                    print >>fh, '%7d  %-8s %12.5f %2d' % (i * 37, 'src%d' % (i % 500), i / 7., i % 3)
+            for opt in ({}, dict(columns=['name', 'x']), dict(rows=(10, 20)), dict(lazy=True)):
+                data = read_ascii_table(filename, profile=True, **opt)
+                self.assertTrue(('fixed_width', {'ok': True}) in
+                                [(x[0], x[2]) for x in data.read_stats.stages])
+                csv_data = read_ascii_table(filename, fixed_width=False, **opt)
+                if opt.get('lazy'):
+                    data, csv_data = data.as_array(), csv_data.as_array()
+                self.assertEqual(data.dtype, csv_data.dtype)
+                self.assertTrue(numpy.all(data == csv_data))
+
+            # Ragged lines with one very long value are rejected before the
+            # lines are padded into a block
+            filename = os.path.join(tmpdir, 'ragged.txt')
+            with open(filename, 'w') as fh:
+                print >>fh, 'id name'
+                for i in range(3000):
+                    print >>fh, '%d %s' % (i, 'x' * (2000 if i == 1500 else i % 7 + 1))
+            data = read_ascii_table(filename, profile=True)
+            self.assertTrue(('fixed_width', {'ok': False}) in
+                            [(x[0], x[2]) for x in data.read_stats.stages])
+            self.assertEqual(data.tolist(), read_ascii_table(filename, fixed_width=False).tolist())
+        finally:
+            shutil.rmtree(tmpdir)
+
+        # Not aligned, so parsed with csv
+        data = read_ascii_table('t/test4.dat', profile=True)
+        self.assertTrue(('fixed_width', {'ok': False}) in
+                        [(x[0], x[2]) for x in data.read_stats.stages])
+
+    def test25_categorical(self):
+        data = read_ascii_table('t/test4.dat')
+        encoded = read_table('t/test4.dat', categorical=True)
+        self.assertEqual(encoded['statname'].dtype, numpy.uint8)
+        self.assertEqual(sorted(encoded.categories), ['statname'])
+        self.assertTrue(encoded.nbytes < data.nbytes)
+        self.assertTrue(numpy.all(decode_categories(encoded) == data))
+        self.assertEqual(encoded.table_schema.dtype, data.dtype)
+
+        ok = encoded['statname'] == category_code(encoded, 'statname', 'cash')
+        self.assertTrue(numpy.all(ok == (data['statname'] == 'cash')))
+        self.assertEqual(category_code(encoded, 'statname', 'nope'), -1)
+
+        encoded = read_ascii_table('t/simple2.txt', categorical=['object'])
+        self.assertEqual(encoded.categories['object'].tolist(),
+                         ['Q1250+568-A', 'Q1250+568-B', 'Source 82'])
+        self.assertRaises(ValueError, read_ascii_table, 't/simple2.txt', categorical=['nope'])
+
+        # Tables with different categories are concatenated by value
+        tables = [['s n', 'b 1', 'c 2'], ['s n', 'a 3', 'c 4', 'a 5']]
+        for joined in (concatenate_tables([read_ascii_table(x, categorical=['s']) for x in tables]),
+                       read_tables(tables, workers=2, categorical=['s'], concatenate=True)):
+            self.assertEqual(joined['s'].tolist(), ['b', 'c', 'a', 'c', 'a'])
+            self.assertEqual(joined['n'].tolist(), [1, 2, 3, 4, 5])
+            self.assertFalse(getattr(joined, 'categories', None))
+
+        tmpdir = mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'test4.fits')
+            write_fits_table(filename, read_table('t/test4.dat', categorical=True))
+            out = read_fits_table(filename)
+            self.assertEqual(out.dtype, data.dtype)
+            self.assertTrue(numpy.all(out == data))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test26_null_values(self):
+        lines = ['a b c d', '1 2.5 x 7', '- 3.5 - NA', '3 - y 9']
+        data = read_ascii_table(lines, null_values=['-', 'NA'])
+        self.assertTrue(isinstance(data, numpy.ma.MaskedArray))
+        self.assertEqual([data.dtype[i].kind for i in range(4)], ['i', 'f', 'S', 'i'])
+        self.assertEqual(data['a'].mask.tolist(), [False, True, False])
+        self.assertEqual(data['b'].mask.tolist(), [False, False, True])
+        self.assertEqual(data['c'].tolist(), ['x', '-', 'y'])
+        self.assertEqual(data['d'].sum(), 16)
+
+        data = read_ascii_table(lines, null_values={'a': ['-'], None: ['NA']},
+                                null_fill={'a': -99})
+        self.assertEqual(data['a'].tolist(), [1, -99, 3])
+        self.assertEqual(data['b'].dtype.kind, 'S')
+        self.assertEqual(data['d'].dtype.kind, 'f')
+        self.assertTrue(numpy.isnan(data['d'][1]))
+        self.assertEqual(data.nulls, {'a': -99})
+
+        tmpdir = mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'nulls.fits')
+            write_fits_table(filename, read_ascii_table(lines, null_values=['-', 'NA']))
+            out = read_fits_table(filename)
+            self.assertEqual(out['a'].tolist(), [1, -2**31, 3])
+            self.assertTrue(numpy.isnan(out['b'][2]))
+            hdus = read_fits_headers(filename)
+            self.assertEqual(hdus[1]['TNULL1'], -2**31)
+
+            # Dictionary-encoded columns are written as their values
+            write_fits_table(filename, read_ascii_table(lines, null_values=['-', 'NA'],
+                                                        categorical=['c']))
+            self.assertEqual(read_fits_table(filename)['c'].tolist(), ['x', '-', 'y'])
+
+            # The null values of integer columns are kept in the cache
+            table_file = os.path.join(tmpdir, 'nulls.txt')
+            with open(table_file, 'w') as fh:
+                fh.write('\n'.join(lines) + '\n')
+            cache = TableCache(os.path.join(tmpdir, 'cache'), max_memory=0)
+            for i in range(2):
+                data = cache.read_table(table_file, null_values=['-'], null_fill=-1)
+            self.assertEqual(cache.stats['disk_hits'], 1)
+            self.assertEqual(data.nulls, {'a': -1})
+        finally:
+            shutil.rmtree(tmpdir)
+
+        data = concatenate_tables([read_ascii_table(lines, null_values=['-', 'NA'])] * 2)
+        self.assertEqual(data['a'].mask.tolist(), [False, True, False] * 2)
+        data = read_tables([lines] * 2, workers=2, null_values=['-', 'NA'], concatenate=True)
+        self.assertEqual(data['b'].mask.tolist(), [False, False, True] * 2)
+
+    def test27_write_ascii_rdb(self):
+        data = read_ascii_table('t/test4.dat')
+        strings = numpy.array(['', 'a b', 'x"y', '#c', "it's", 'p,q'])
+        quoted = numpy.rec.fromarrays([strings, numpy.arange(6) / 3., numpy.arange(6) - 3],
+                                      names=['s s', 'f', 'i'])
+        tmpdir = mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'out.dat')
+            for table in (data, quoted):
+                for opt in ({}, dict(delimiter=','), dict(delimiter='|', quotechar="'"),
+                            dict(delimiter='\t', quoting='all', chunk_rows=2)):
+                    write_ascii_table(filename, table, **opt)
+                    out = read_ascii_table(filename)
+                    self.assertEqual(out.dtype, table.dtype)
+                    self.assertEqual(out.tolist(), table.tolist())
+
+            # Stream of chunks and categorical columns
+            write_ascii_table(filename, read_ascii_table_chunks('t/test4.dat', chunk_rows=7))
+            self.assertEqual(read_ascii_table(filename).tolist(), data.tolist())
+            write_ascii_table(filename, read_ascii_table('t/test4.dat', categorical=True))
+            self.assertEqual(read_ascii_table(filename).tolist(), data.tolist())
+
+            filename = os.path.join(tmpdir, 'out.rdb')
+            write_rdb_table(filename, data, chunk_rows=5)
+            out = read_rdb_table(filename)
+            self.assertEqual(out.dtype, data.dtype)
+            self.assertEqual(out.tolist(), data.tolist())
+            self.assertRaises(ValueError, write_rdb_table, filename,
+                              numpy.rec.fromarrays([numpy.array(['a\tb'])], names=['s']))
+
+            # Missing values of a masked array
+            lines = ['a b s', '1 2.5 x', '- 3 y', '4 - x']
+            masked = read_ascii_table(lines, null_values=['-'], categorical=['s'])
+            self.assertRaises(ValueError, write_ascii_table, filename, masked)
+            for write, opt in ((write_ascii_table, dict(null_value='')),
+                               (write_ascii_table, dict(null_value='-', delimiter=',')),
+                               (write_rdb_table, dict(null_value='NA'))):
+                write(filename, masked, **opt)
+                out = read_table(filename, null_values=[opt['null_value']],
+                                 headerrow=1, datastart=3 if write is write_rdb_table else 2)
+                self.assertEqual(out.tolist(), [(1, 2.5, 'x'), (None, 3.0, 'y'), (4, None, 'x')])
+            self.assertRaises(ValueError, write_rdb_table, filename, masked, null_value='')
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     unittest.main()